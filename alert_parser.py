@@ -0,0 +1,59 @@
+# Parser for the raw alert output pasted from the CDC
+
+from itertools import islice
+import re
+
+# All patterns are compiled once when the module is imported
+CASE_NUMBER_RE = re.compile(r"^(OCD_INC[0-9]+)")
+TIMESTAMP_RE = re.compile(r"([0-9]{4}\-[0-9]{2}\-[0-9]{2})T([0-9:\.]+)Z$")
+KEY_VALUE_RE = re.compile(r"^([^:]+):[\s ]*(.*)$")
+
+# The case number, ID and timestamp lines come before the key-value lines
+HEADER_LINES = 3
+
+# Keys that are stored under a different name in the alert dictionary
+RENAMED_KEYS = {"customername": "customer-name"}
+
+# Goes through the key-value lines of an alert in a single pass and yields tuples of
+# (key, fragments), where fragments is a list holding the value followed by the
+# continuation lines belonging to it. The lists are extended while the lines are read,
+# so they are only complete once the generator is exhausted.
+def tokenizeAlert(lines):
+    match_key_value = KEY_VALUE_RE.match
+    fragments = None
+    for line in lines:
+        m = match_key_value(line)
+        if m:
+            key = m.group(1).lower().strip()
+            fragments = [m.group(2).strip()]
+            yield RENAMED_KEYS.get(key, key), fragments
+        elif fragments is not None:
+            # If the line doesn't contain a key like it doesn't after the description field in Sentinelv2 alerts, then we just add the line to the last key.
+            fragments.append(line)
+
+# Reads the lines coming from CDC output, a list or any iterable, and generates a
+# dictionary. Only the header lines are taken out, the rest are parsed while they are
+# read. The case number is read from the first line and the timestamp from the first of
+# the other header lines that holds one. Without any, the timestamp is left out, so that
+# the parse hook of the alert type can supply it.
+def parseAlert(lines):
+    lines = iter(lines)
+    header = list(islice(lines, HEADER_LINES))
+    m = CASE_NUMBER_RE.match(header[0])
+    alert_dict = {'case-number': m.group(1)}
+
+    for line in header[1:]:
+        m = TIMESTAMP_RE.search(line)
+        if m:
+            # Match.expand parses its template on every call, which is slow enough to show
+            alert_dict['timestamp'] = m.group(1) + " " + m.group(2) + " UTC"
+            break
+
+    # Continuation lines are collected in lists and only joined once at the end.
+    key_fragments = {}
+    for key, fragments in tokenizeAlert(lines):
+        key_fragments[key] = fragments
+    for key, fragments in key_fragments.items():
+        alert_dict[key] = " ".join(fragments)
+
+    return alert_dict
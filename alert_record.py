@@ -0,0 +1,163 @@
+# Compact record of a parsed alert
+#
+# Alerts parsed by formatAlertDict are dictionaries with one string per key. Defender
+# alerts pack lists of hosts, users and processes into comma separated strings, which
+# every user of the alert had to split again. An AlertRecord splits them once into
+# tuples, one per column, and keeps the remaining fields in a dictionary with interned
+# keys, so that many records can be held in memory at once.
+
+from collections import namedtuple
+import sys
+
+# Columns of the process table in Defender alerts and the alert keys they are read from
+PROCESS_COLUMNS = (
+    ('commands', 'process'),
+    ('processes', 'process exec'),
+    ('paths', 'process path'),
+    ('sha256s', 'process hash sha256'),
+    ('users', 'process owner'),
+    ('parents', 'parent process exec'),
+)
+
+# Comma separated keys stored as columns on the record instead of in the fields. The
+# process keys are only comma separated in Defender alerts, which are recognized by the
+# 'process' key. Sentinel alerts use some of the same keys for a single process.
+LIST_KEYS = ('dvc', 'user')
+PROCESS_KEYS = tuple(key for _, key in PROCESS_COLUMNS)
+
+# A single row of the process table, i.e. one execution flow
+ProcessFlow = namedtuple("ProcessFlow", ["command", "process", "path", "sha256", "user", "parent"])
+
+# Splits a comma separated string into a tuple of stripped values. Hosts, users, process
+# names and hashes repeat across alerts, so by default the values are interned and
+# shared between all records holding them.
+def splitValues(value, intern=True):
+    if intern:
+        return tuple(sys.intern(v.strip()) for v in value.split(','))
+    return tuple(v.strip() for v in value.split(','))
+
+# Process lists of a Defender alert stored column by column
+class ProcessTable:
+    __slots__ = tuple(name for name, _ in PROCESS_COLUMNS)
+
+    # Columns missing from the alert are stored as None
+    def __init__(self, alert_dict):
+        for name, key in PROCESS_COLUMNS:
+            # Command lines are rarely repeated, so they are not interned
+            setattr(self, name, splitValues(alert_dict[key], name != 'commands') if key in alert_dict else None)
+
+    # Returns the columns in the order of ProcessFlow, with missing columns as empty values
+    def filledColumns(self):
+        return [getattr(self, name) or ("",) for name, _ in PROCESS_COLUMNS]
+
+    # Number of complete rows, i.e. the length of the shortest column
+    def __len__(self):
+        return min(len(column) for column in self.filledColumns())
+
+    def rows(self):
+        return [ProcessFlow(*row) for row in zip(*self.filledColumns())]
+
+    def column(self, key):
+        for name, column_key in PROCESS_COLUMNS:
+            if column_key == key:
+                return getattr(self, name)
+        raise KeyError(key)
+
+class AlertRecord:
+    __slots__ = ('case_number', 'timestamp', 'customer_name', 'fields', 'hosts', 'users', 'processes')
+
+    def __init__(self, case_number, timestamp, customer_name, fields, hosts=None, users=None, processes=None):
+        self.case_number = case_number
+        self.timestamp = timestamp
+        self.customer_name = customer_name
+        self.fields = fields
+        self.hosts = hosts
+        self.users = users
+        self.processes = processes
+
+    # Builds a record from a dictionary made by formatAlertDict
+    @classmethod
+    def fromDict(cls, alert_dict):
+        processes = ProcessTable(alert_dict) if 'process' in alert_dict else None
+        column_keys = LIST_KEYS + PROCESS_KEYS if processes is not None else LIST_KEYS
+
+        fields = {}
+        for key, value in alert_dict.items():
+            if key not in column_keys and key not in ('case-number', 'timestamp', 'customer-name'):
+                fields[sys.intern(key)] = value
+
+        hosts = splitValues(alert_dict['dvc']) if 'dvc' in alert_dict else None
+        users = splitValues(alert_dict['user']) if 'user' in alert_dict else None
+
+        return cls(alert_dict['case-number'], alert_dict['timestamp'], alert_dict.get('customer-name'), fields, hosts, users, processes)
+
+    # Returns the column holding the values of a comma separated key, or None if the key
+    # is not stored as a column
+    def listValues(self, key):
+        if key == 'dvc':
+            return self.hosts
+        if key == 'user':
+            return self.users
+        if self.processes is not None and key in PROCESS_KEYS:
+            return self.processes.column(key)
+        return None
+
+    # The record can be read like the dictionary it was made from. Comma separated keys
+    # are joined back together from their columns.
+    def get(self, key, default=None):
+        # Most keys are fields, which never hold the keys stored as columns
+        value = self.fields.get(key)
+        if value is not None:
+            return value
+        if key == 'case-number':
+            return self.case_number
+        if key == 'timestamp':
+            return self.timestamp
+        if key == 'customer-name':
+            return default if self.customer_name is None else self.customer_name
+        if key in LIST_KEYS or (self.processes is not None and key in PROCESS_KEYS):
+            values = self.listValues(key)
+            return default if values is None else ", ".join(values)
+        return default
+
+    # Returns the single values of a key, taken from its column if it is stored as one and
+    # split at the commas otherwise, or an empty tuple if the alert does not have the key
+    def keyValues(self, key):
+        values = self.listValues(key)
+        if values is not None:
+            return values
+        value = self.get(key)
+        return () if value is None else tuple(v.strip() for v in value.split(','))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    # Keys of the alert, in no particular order
+    def keys(self):
+        keys = ['case-number', 'timestamp']
+        if self.customer_name is not None:
+            keys.append('customer-name')
+        keys.extend(self.fields)
+        keys.extend(key for key in LIST_KEYS + PROCESS_KEYS if self.listValues(key) is not None)
+        return keys
+
+    # Values of the alert as in the dictionary it was made from
+    def values(self):
+        return list(self.toDict().values())
+
+    def toDict(self):
+        alert_dict = {'case-number': self.case_number, 'timestamp': self.timestamp}
+        if self.customer_name is not None:
+            alert_dict['customer-name'] = self.customer_name
+        alert_dict.update(self.fields)
+        for key in LIST_KEYS + PROCESS_KEYS:
+            values = self.listValues(key)
+            if values is not None:
+                alert_dict[key] = ", ".join(values)
+        return alert_dict
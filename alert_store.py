@@ -0,0 +1,213 @@
+# Local SQLite database of the parsed alerts, used to look up earlier sightings of hosts,
+# users, hashes and other indicators during triage.
+
+from alert_record import AlertRecord
+from ioc_extractor import KINDS as IOC_KINDS, extractIocs, refang
+
+import json
+import os
+import sqlite3
+import sys
+
+DEFAULT_DATABASE_FN = "alerts.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    case_number TEXT NOT NULL UNIQUE,
+    customer_code TEXT,
+    timestamp TEXT,
+    alert_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_customer_code ON alerts(customer_code);
+CREATE TABLE IF NOT EXISTS alert_values (
+    alert_id INTEGER NOT NULL REFERENCES alerts(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alert_values_lookup ON alert_values(kind, value);
+CREATE INDEX IF NOT EXISTS alert_values_alert ON alert_values(alert_id);
+CREATE TABLE IF NOT EXISTS digest_counts (
+    day TEXT NOT NULL,
+    customer_code TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, customer_code, dimension, value)
+) WITHOUT ROWID;
+"""
+
+# Alert keys holding the indexed values of each kind. Keys with comma separated lists of
+# values, as in Defender alerts, are split into the single values.
+INDEXED_KEYS = {
+    'host': ['asset', 'asset key', 'dvc'],
+    'user': ['asset user', 'user', 'process owner'],
+    'sha256': ['process sha256', 'process hash sha256'],
+}
+# Alert keys counted per day and customer in the digest, besides the number of alerts.
+# Hosts and users are lowercased like the indexed values.
+DIGEST_KEYS = {
+    'pattern': ['info sub name'],
+    'mitre': ['info mitre id'],
+    'host': INDEXED_KEYS['host'],
+    'user': INDEXED_KEYS['user'],
+}
+VALUE_KINDS = list(INDEXED_KEYS) + [kind for kind in IOC_KINDS if kind not in INDEXED_KEYS]
+KINDS = ['case', 'customer'] + VALUE_KINDS
+
+# Returns the single values of a key of an alert dictionary or AlertRecord. Records
+# already hold the comma separated lists of Defender alerts split into columns.
+def keyValues(alert_dict, key):
+    if isinstance(alert_dict, AlertRecord):
+        return alert_dict.keyValues(key)
+    return [value.strip() for value in alert_dict.get(key, "").split(',')]
+
+# Returns the set of (kind, value) pairs to index for an alert, which are the values of
+# the keys in INDEXED_KEYS and the indicators found in any of the alert values. The
+# indicators are extracted unless already given as (kind, value) pairs from extractIocs.
+# Values are lowercased so that lookups are case insensitive.
+def indexedValues(alert_dict, iocs=None):
+    values = set()
+    for kind, keys in INDEXED_KEYS.items():
+        for key in keys:
+            for value in keyValues(alert_dict, key):
+                value = value.lower()
+                if value != "" and value != "-":
+                    values.add((kind, value))
+    if iocs is None:
+        iocs = extractIocs(alert_dict.values())
+    values.update((kind, value.lower()) for kind, value in iocs)
+    return values
+
+# Returns the set of (dimension, value) pairs an alert adds to the digest counts of its
+# day and customer, including ('alerts', '') for the alert itself.
+def digestValues(alert_dict):
+    values = {('alerts', "")}
+    for dimension, keys in DIGEST_KEYS.items():
+        for key in keys:
+            for value in keyValues(alert_dict, key):
+                if value != "" and value != "-" and value != "``":
+                    values.add((dimension, value.lower() if dimension in ('host', 'user') else value))
+    return values
+
+# Returns the path of the alert database given in the settings, which by default lies in
+# the output folder.
+def databasePath(settings_dict):
+    return settings_dict.get('alert-database', os.path.join(settings_dict['output-folder'], DEFAULT_DATABASE_FN))
+
+class AlertStore:
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+
+    # Stores an alert within the current transaction, replacing any earlier alert with
+    # the same case number, and adds it to the digest counts. The counts of a replaced
+    # alert are taken back first. The indicators of the alert may be given if already
+    # extracted. The alert may be given as a dictionary or an AlertRecord.
+    def insertAlert(self, alert_dict, customer_code, iocs=None):
+        old = self.connection.execute("SELECT customer_code, alert_json FROM alerts WHERE case_number = ?", (alert_dict['case-number'],)).fetchone()
+        if old is not None:
+            self.updateDigest(json.loads(old[1]), old[0], -1)
+            self.connection.execute("DELETE FROM alerts WHERE case_number = ?", (alert_dict['case-number'],))
+        self.updateDigest(alert_dict, customer_code, 1)
+        cursor = self.connection.execute("INSERT INTO alerts (case_number, customer_code, timestamp, alert_json) VALUES (?, ?, ?, ?)",
+            (alert_dict['case-number'], customer_code, alert_dict.get('timestamp'), json.dumps(alert_dict.toDict() if isinstance(alert_dict, AlertRecord) else alert_dict)))
+        self.connection.executemany("INSERT INTO alert_values (alert_id, kind, value) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, kind, value) for kind, value in indexedValues(alert_dict, iocs)])
+
+    # Adds change to the digest counts of the values of an alert on its day and customer,
+    # using a single upsert per value. Counts that drop to zero are removed.
+    def updateDigest(self, alert_dict, customer_code, change):
+        day = alert_dict.get('timestamp', "")[:10]
+        customer_code = customer_code or ""
+        self.connection.executemany("INSERT INTO digest_counts (day, customer_code, dimension, value, count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, customer_code, dimension, value) DO UPDATE SET count = count + excluded.count",
+            [(day, customer_code, dimension, value, change) for dimension, value in digestValues(alert_dict)])
+        if change < 0:
+            self.connection.execute("DELETE FROM digest_counts WHERE day = ? AND customer_code = ? AND count <= 0", (day, customer_code))
+
+    # Returns (customer code, dimension, value, count) of the digest counts of a day, for
+    # all customers or a single one, with the highest counts first. Only the rows of the
+    # day are read, however long the history is.
+    def digest(self, day, customer_code=None):
+        query = "SELECT customer_code, dimension, value, count FROM digest_counts WHERE day = ?"
+        parameters = (day,)
+        if customer_code is not None:
+            query += " AND customer_code = ?"
+            parameters = (day, customer_code)
+        return self.connection.execute(query + " ORDER BY customer_code, dimension, count DESC, value", parameters).fetchall()
+
+    # Recounts the digest from all stored alerts, e.g. for alerts stored before the digest
+    # existed. Returns the number of counted alerts.
+    def rebuildDigest(self):
+        n_alerts = 0
+        try:
+            self.connection.execute("DELETE FROM digest_counts")
+            for customer_code, alert_json in self.connection.execute("SELECT customer_code, alert_json FROM alerts"):
+                self.updateDigest(json.loads(alert_json), customer_code, 1)
+                n_alerts += 1
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        return n_alerts
+
+    # Returns (case number, customer code, timestamp) of the alerts matching a value of a
+    # kind, which is one of KINDS. Defanged indicators are looked up as the original.
+    def find(self, kind, value):
+        if kind == 'case':
+            query = "SELECT case_number, customer_code, timestamp FROM alerts WHERE case_number = ?"
+        elif kind == 'customer':
+            query = "SELECT case_number, customer_code, timestamp FROM alerts WHERE customer_code = ?"
+        elif kind in VALUE_KINDS:
+            query = "SELECT a.case_number, a.customer_code, a.timestamp FROM alert_values v JOIN alerts a ON a.id = v.alert_id WHERE v.kind = ? AND v.value = ?"
+            return self.connection.execute(query + " ORDER BY a.timestamp", (kind, refang(value.strip()).lower())).fetchall()
+        else:
+            raise ValueError("ERROR in AlertStore.find:\nUnknown kind '" + kind + "'. Use one of " + ", ".join(KINDS))
+        return self.connection.execute(query + " ORDER BY timestamp", (value.strip(),)).fetchall()
+
+    # Returns a dictionary from each of the given (kind, value) indicators that has been
+    # seen in other alerts than the given case to the case numbers of those alerts, oldest
+    # first. Indicators that have not been seen before are left out.
+    def sightings(self, iocs, case_number):
+        query = "SELECT DISTINCT a.case_number, a.timestamp FROM alert_values v JOIN alerts a ON a.id = v.alert_id WHERE v.kind = ? AND v.value = ? AND a.case_number != ? ORDER BY a.timestamp"
+        found = {}
+        for kind, value in iocs:
+            rows = self.connection.execute(query, (kind, value.lower(), case_number)).fetchall()
+            if rows:
+                found[(kind, value)] = [row[0] for row in rows]
+        return found
+
+# Looks up earlier alerts from the command line, e.g. `python alert_store.py sha256 <hash>`
+def main(argv):
+    import argparse
+    from file_functions import loadSettings
+
+    parser = argparse.ArgumentParser(description="Look up earlier alerts in the alert database.")
+    parser.add_argument("kind", choices=KINDS, help="What to look up.")
+    parser.add_argument("value", help="The value to look for.")
+    args = parser.parse_args(argv)
+
+    with AlertStore(databasePath(loadSettings())) as store:
+        rows = store.find(args.kind, args.value)
+    for case_number, customer_code, timestamp in rows:
+        print(f"{timestamp}  {customer_code}  {case_number}")
+    if not rows:
+        print("No earlier alerts found.")
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
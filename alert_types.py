@@ -0,0 +1,167 @@
+# Registry of the kinds of alerts and the templates used for their reports
+#
+# Every kind of alert is described by an AlertType with a key signature: keys of which
+# at least one has to be in the alert (any_keys) and keys that all have to be in it
+# (all_keys). Types are tried from the highest priority down, and a type without any
+# keys matches every alert, which makes it a fallback. A new source is supported by
+# registering a type for it with registerAlertType, together with its hooks:
+#
+#   parse(alert_dict)         returns the dictionary made by parseAlert adjusted for
+#                             the source, e.g. with keys renamed or the timestamp
+#                             supplied when the header lines have none
+#   context(record, context)  adds the descriptions, users, hosts and processes to the
+#                             context made by reportContext, usually by calling
+#                             sharedContext and adding the values specific to the source
+#
+# Every key named in a signature is given a bit, and the signature of an alert is found
+# from the intersection of those keys with the keys of the alert. The type matching a
+# signature is only searched for the first time the signature is seen, so registering
+# more types does not slow down the detection of the others.
+
+# Returns the value of a key in the alert if it holds something worth reporting and None
+# otherwise.
+def nonemptyValue(alert_dict, key):
+    value = alert_dict.get(key, "")
+    if value != "" and value != "``":
+        return value
+    return None
+
+class AlertType:
+    __slots__ = ('name', 'template', 'any_keys', 'all_keys', 'priority', 'parse', 'context', 'any_mask', 'all_mask')
+
+    def __init__(self, name, any_keys=(), all_keys=(), priority=0, template=None, parse=None, context=None):
+        self.name = name
+        # Several types can share a template, by default the one named like the type
+        self.template = template or name
+        self.any_keys = frozenset(any_keys)
+        self.all_keys = frozenset(all_keys)
+        self.priority = priority
+        self.parse = parse
+        self.context = context
+        # The signature as bits, set when the type is registered
+        self.any_mask = 0
+        self.all_mask = 0
+
+    def __repr__(self):
+        return f"AlertType({self.name!r})"
+
+    def matchesMask(self, mask):
+        return (not self.any_mask or mask & self.any_mask) and mask & self.all_mask == self.all_mask
+
+# Registered types from the highest priority down
+alert_types = []
+# Bit of every key named in a signature
+key_bits = {}
+# Types found for the signatures seen so far
+types_by_mask = {}
+# Registered types with a parse hook
+parsing_types = []
+
+# Adds a type to the registry, replacing a registered type with the same name
+def registerAlertType(alert_type):
+    alert_types[:] = [registered for registered in alert_types if registered.name != alert_type.name]
+    alert_types.append(alert_type)
+    # sort is stable, so types with the same priority are tried in order of registration
+    alert_types.sort(key=lambda registered: -registered.priority)
+
+    key_bits.clear()
+    for registered in alert_types:
+        for key in sorted(registered.any_keys | registered.all_keys):
+            key_bits.setdefault(key, 1 << len(key_bits))
+    for registered in alert_types:
+        registered.any_mask = sum(key_bits[key] for key in registered.any_keys)
+        registered.all_mask = sum(key_bits[key] for key in registered.all_keys)
+
+    types_by_mask.clear()
+    parsing_types[:] = [registered for registered in alert_types if registered.parse is not None]
+    return alert_type
+
+# Returns the AlertType of an alert dictionary or AlertRecord
+def detectAlertType(alert_dict):
+    mask = 0
+    for key in key_bits.keys() & alert_dict.keys():
+        mask |= key_bits[key]
+
+    alert_type = types_by_mask.get(mask)
+    if alert_type is None:
+        for registered in alert_types:
+            if registered.matchesMask(mask):
+                alert_type = registered
+                break
+        else:
+            raise ValueError("ERROR in detectAlertType:\nNo alert type matches the alert " + str(alert_dict.get('case-number')))
+        types_by_mask[mask] = alert_type
+    return alert_type
+
+# Applies the parse hook of the type of a freshly parsed alert. Nothing is detected as
+# long as no registered type has a parse hook.
+def parseHook(alert_dict):
+    if not parsing_types:
+        return alert_dict
+    alert_type = detectAlertType(alert_dict)
+    if alert_type.parse is None:
+        return alert_dict
+    return alert_type.parse(alert_dict)
+
+# Returns the values worth reporting of the given keys of an alert
+def nonemptyValues(record, keys):
+    return [value for value in (nonemptyValue(record, key) for key in keys) if value is not None]
+
+# Values shown for every kind of alert that has them, whichever source their keys come
+# from, so that an alert mixing the keys of several sources loses none of them. The
+# context hooks of the types add what is specific to their source on top.
+def sharedContext(record, context):
+    context['descriptions'] = nonemptyValues(record, ('info description', 'incident title'))
+    context['details'] = nonemptyValues(record, ('description', 'title'))
+    if 'asset user' in record:
+        context['users'] = [record['asset user']]
+    elif record.users is not None:
+        context['users'] = record.users
+    processContext(record, context)
+
+def processContext(record, context):
+    if 'process name' in record:
+        context['initiating_process'] = {
+            'name': record['process name'],
+            'path': nonemptyValue(record, 'process path'),
+            'command': nonemptyValue(record, 'process commandline'),
+            'sha256': nonemptyValue(record, 'process sha256'),
+        }
+    if 'parent process' in record:
+        context['parent_process'] = {
+            'name': record['parent process'],
+            'command': nonemptyValue(record, 'parent process commandline'),
+        }
+    # The processes of each execution flow, which the record holds as a table
+    if record.processes is not None:
+        context['flows'] = record.processes.rows()
+
+# Sentinel alerts describe a single asset, and the devices of the alert are only shown
+# when it has no asset keys
+def sentinelContext(record, context):
+    sharedContext(record, context)
+    if 'asset key' in record or 'asset ipv4' in record:
+        # The key of an asset without a host name is its IP address, which is shown anyway
+        asset_key = record.get('asset key', "")
+        if asset_key == record.get('asset ipv4'):
+            asset_key = ""
+        context['asset'] = {'key': asset_key, 'ipv4': record.get('asset ipv4', "")}
+    elif record.hosts is not None:
+        context['hosts'] = record.hosts
+
+# Defender alerts list the devices involved
+def defenderContext(record, context):
+    sharedContext(record, context)
+    if record.hosts is not None:
+        context['hosts'] = record.hosts
+
+# Keys only found in Sentinel alerts. Sentinel v2 alerts also have a description.
+SENTINEL_KEYS = ('asset key', 'asset ipv4', 'info description')
+DEFENDER_KEYS = ('dvc', 'process', 'incident title')
+
+registerAlertType(AlertType("sentinel_v2", any_keys=SENTINEL_KEYS, all_keys=('description',), priority=40, context=sentinelContext))
+registerAlertType(AlertType("sentinel", any_keys=SENTINEL_KEYS, priority=30, context=sentinelContext))
+registerAlertType(AlertType("defender", any_keys=DEFENDER_KEYS, priority=20, context=defenderContext))
+# Alerts without any of the keys above are taken as Sentinel alerts of the matching version
+registerAlertType(AlertType("sentinel_v2_partial", all_keys=('description',), priority=10, template="sentinel_v2", context=sharedContext))
+registerAlertType(AlertType("unknown", priority=0, template="sentinel", context=sharedContext))
@@ -0,0 +1,39 @@
+# Writing of files that are replaced in a single step
+#
+# The content is written to a temporary file with a unique name in the same folder, which
+# is renamed into place once it is complete. An interrupted write never leaves a half
+# written file behind, and processes writing the same file at the same time never share
+# a temporary file.
+
+import os
+
+# Writes the file at path by calling write with the temporary file opened for writing
+# bytes, and renames the temporary file into place. With fsync the content is synced to
+# disk before the rename. The temporary file is removed if anything goes wrong.
+def writeFileAtomically(path, write, fsync=True):
+    # Only imported once something is written, since importing it takes a few ms
+    import tempfile
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates files readable only by the owner, so give the file the mode of
+        # the file it replaces or the default mode of new files.
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
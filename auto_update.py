@@ -1,11 +1,29 @@
 # Functions for automatic updates
 
-import requests
+# requests and zipfile are imported inside the functions that use them, since most runs
+# never get past the check interval and should not pay for importing them.
+import hashlib
+import json
 import re
+import shutil
 import time
 import os
-import hashlib
-import zipfile
+import subprocess
+import sys
+import zlib
+
+from atomic_write import writeFileAtomically
+from config import SETTINGS_SPEC
+
+# The scripts are updated in place, wherever they are started from
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+# Timeout of the requests made without settings, the default of the update-timeout setting
+DEFAULT_TIMEOUT = SETTINGS_SPEC['update-timeout'][1]
+MANIFEST_FN = "install_manifest.json"
+
+# Size of the chunks used when downloading and extracting, which bounds the memory used
+# no matter how large the archive is.
+CHUNK_SIZE = 64*1024
 
 # Check two version strings and determine if the left argument represents a "greater" version than the right
 def leftVersionGreater(left_version, right_version):
@@ -41,12 +59,57 @@ def getVersionString(file_string):
         return ""
 
 # Uses the request module to get the text content from a URL.
-def getUrlContent(url):
-    res = requests.get(url)
+def getUrlContent(url, timeout=DEFAULT_TIMEOUT):
+    import requests
+    res = requests.get(url, timeout=timeout)
     if res.status_code != 200:
-        raise Exception("ERROR in getUrlContent:\nReceived code '" + res.status_code + "'\nwhen attempting to get content at URL:\n\"" + url + "\"")
+        raise Exception("ERROR in getUrlContent:\nReceived code '" + str(res.status_code) + "'\nwhen attempting to get content at URL:\n\"" + url + "\"")
     return res.text
 
+# Loads the stored ETag, Last-Modified and version of each checked URL from the state
+# file. A missing or broken state file just means that nothing is known yet.
+def loadUpdateState(state_fn):
+    try:
+        with open(state_fn, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveUpdateState(state_fn, state):
+    with open(state_fn, 'w') as f:
+        print(json.dumps(state, indent=4), file=f, end='')
+
+# Gets the version of the file at a URL with a conditional request, using the ETag and
+# Last-Modified of the previous response stored in the state file. The body is only
+# downloaded when the remote file has changed, otherwise the stored version is returned.
+def getRemoteVersion(url, state_fn, timeout=DEFAULT_TIMEOUT):
+    import requests
+    state = loadUpdateState(state_fn)
+    url_state = state.get(url, {})
+
+    headers = {}
+    if 'version' in url_state:
+        if 'etag' in url_state:
+            headers['If-None-Match'] = url_state['etag']
+        if 'last-modified' in url_state:
+            headers['If-Modified-Since'] = url_state['last-modified']
+
+    res = requests.get(url, headers=headers, timeout=timeout)
+    if res.status_code == 304:
+        return url_state['version']
+    if res.status_code != 200:
+        raise Exception("ERROR in getRemoteVersion:\nReceived code '" + str(res.status_code) + "'\nwhen attempting to get content at URL:\n\"" + url + "\"")
+
+    url_state = {'version': getVersionString(res.text)}
+    if 'ETag' in res.headers:
+        url_state['etag'] = res.headers['ETag']
+    if 'Last-Modified' in res.headers:
+        url_state['last-modified'] = res.headers['Last-Modified']
+    state[url] = url_state
+    saveUpdateState(state_fn, state)
+
+    return url_state['version']
+
 # Reads the file with the input file in the current folder and returns the number of
 # days between now and the timestamp given in the file.
 def daysSinceUpdate(fn):
@@ -55,6 +118,11 @@ def daysSinceUpdate(fn):
     fn_time = float(fn_time_str)
     return int((round(time.time()) - fn_time)//(24*60*60))
 
+# Returns True if more days than the check-interval key have passed since the time
+# stored in the file given by the last-check-fn key.
+def checkIsDue(settings_dict):
+    return daysSinceUpdate(settings_dict['last-check-fn']) > settings_dict['check-interval']
+
 # This functions takes in settings_dict and reads the time of
 # the last update from the file specified in the last-check-fn key. Then it compares
 # the amount of days elapsed to the number of days specified by the check-interval
@@ -68,17 +136,15 @@ def checkForUpdate(settings_dict):
     if days_since_check <= settings_dict['check-interval']:
         return False
     
-    # Get the current repo version
-    repo_text = getUrlContent(settings_dict['remote-url'])
-    repo_version = getVersionString(repo_text)
+    # Get the current repo version. This only downloads the file if it has changed
+    # since the last check.
+    repo_version = getRemoteVersion(settings_dict['remote-url'], settings_dict['update-state-fn'], settings_dict['update-timeout'])
     
     print("Days since last check: " + str(days_since_check))
     print("Most up-to-day version: " + repo_version)
     
     # Get the existing file version
-    with open("sentinel_alerts.py", 'r') as f:
-        file_text = f.read()
-    existing_version = getVersionString(file_text)
+    existing_version = getInstalledVersion()
     
     print("Existing version: " + existing_version)
     
@@ -88,17 +154,29 @@ def checkForUpdate(settings_dict):
     
     return leftVersionGreater(repo_version, existing_version)
 
+# Reads the SHA-256 digest published at a URL. The published file may be in the format
+# written by sha256sum, so only the first 64 character hexadecimal word is used.
+def getPublishedDigest(url, timeout=DEFAULT_TIMEOUT):
+    m = re.search(r"\b([0-9a-fA-F]{64})\b", getUrlContent(url, timeout))
+    if not m:
+        raise Exception("ERROR in getPublishedDigest:\nCould not find a SHA-256 digest at URL:\n\"" + url + "\"")
+    return m.group(1).lower()
+
 # Downloads a file from a URL and saves it is as a file specified by the path. If the
 # path already exists it appends ' (n)' where 'n' is the next available digit to the
-# filename before the last .
-def downloadBytes(url, file_path, overwrite=False):
+# filename before the last . The content is streamed to disk in chunks while its SHA-256
+# is computed. If sha256 is given and does not match, the file is removed and an
+# exception is raised.
+def downloadBytes(url, file_path, overwrite=False, sha256=None, timeout=DEFAULT_TIMEOUT):
 
     # Make sure file paths use backward slashes
     file_path = os.path.normpath(file_path)
 
     # Download file from URL
-    res = requests.get(url)
+    import requests
+    res = requests.get(url, stream=True, timeout=timeout)
     if res.status_code != 200:
+        res.close()
         raise Exception("ERROR in downloadBytes\nFailed to download content from\n" + url)
     
     # Check if file already exists
@@ -127,62 +205,158 @@ def downloadBytes(url, file_path, overwrite=False):
     
     # Now we can be sure that either file_path points to a new file, or we are allowed
     # to overwrite whatever exists there.
-    with open(file_path, 'wb') as f:
-        f.write(res.content)
+    digest = hashlib.sha256()
+    with res, open(file_path, 'wb') as f:
+        for chunk in res.iter_content(CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        os.remove(file_path)
+        raise Exception("ERROR in downloadBytes\nSHA-256 of content from\n" + url + "\nis " + digest.hexdigest() + " but expected " + sha256.lower())
     
     return file_path
 
 # Downloads a .zip file from the supplied url and then extracts that zip file to the
 # destination path.
-def downloadAndExpandArchive(url, path, tmp_fn = "downloaded_archive.zip"):
+def downloadAndExpandArchive(url, path, tmp_fn = "downloaded_archive.zip", sha256=None):
+    import zipfile
 
-    tmp_fn = downloadBytes(url, tmp_fn)
+    tmp_fn = downloadBytes(url, tmp_fn, sha256=sha256)
     
     with zipfile.ZipFile(tmp_fn, 'r') as zip_f:
         zip_f.extractall(path)
     
     os.remove(tmp_fn)
     
-# Downloads a .zip file containing the repository and then extracts all files in the
-# repository to the destination file.
-def downloadRepoTo(url, dest_path, tmp_fn = "downloaded_archive.zip"):
-    
-    tmp_fn = downloadBytes(url, tmp_fn)
+# Loads the manifest of installed files in a folder. The manifest holds the installed
+# version and the CRC-32 and size of every file written by an update.
+def loadManifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_FN), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': "", 'files': {}}
+
+def saveManifest(folder, manifest):
+    data = json.dumps(manifest, indent=4, sort_keys=True).encode("utf8")
+    writeFileAtomically(os.path.join(folder, MANIFEST_FN), lambda f: f.write(data))
+
+# Computes the CRC-32 of a file in chunks, in the same form as zip archives store it.
+def fileCrc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+# Returns True if the file at the path already has the CRC-32 and size of the archive
+# member. The manifest is trusted when it has an entry for the file, otherwise the CRC
+# of the existing file is computed.
+def isUnchanged(path, info, manifest_entry):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if size != info.file_size:
+        return False
+    if manifest_entry is not None:
+        return manifest_entry == {'crc': info.CRC, 'size': info.file_size}
+    return fileCrc(path) == info.CRC
+
+# Downloads a .zip file containing the repository and then extracts the files in the
+# repository that differ from the installed ones to the destination folder. Changed
+# files are written atomically and the manifest in the destination folder is updated
+# with their CRC-32 and size as well as the version of the new sentinel_alerts.py.
+def downloadRepoTo(url, dest_path, tmp_fn = "downloaded_archive.zip", sha256=None):
+    import zipfile
+
+    tmp_fn = downloadBytes(url, tmp_fn, sha256=sha256)
+    manifest = loadManifest(dest_path)
+    installed_files = manifest['files']
+    n_unchanged = 0
     
     with zipfile.ZipFile(tmp_fn, 'r') as zip_f:
     
         # Go through all files in the archive
-        file_paths = zip_f.namelist()
+        infos = zip_f.infolist()
         # Since this is an archive, everything is contained in a folder given by the first
         # entry.
-        folder_name = file_paths[0]
-        for file_path in file_paths[1:]:
+        folder_name = infos[0].filename
+        for info in infos[1:]:
             
             # Creating path to archive file relative to the first folder
-            relative_path = file_path[len(folder_name):]
+            relative_path = info.filename[len(folder_name):]
             dest_file_path = os.path.normpath(dest_path + "/" + relative_path)
             
+            # Folders only need to be created
+            if info.is_dir():
+                os.makedirs(dest_file_path, exist_ok=True)
+                continue
+            
+            if relative_path == "sentinel_alerts.py":
+                manifest['version'] = getVersionString(zip_f.read(info).decode("utf8"))
+            
+            if isUnchanged(dest_file_path, info, installed_files.get(relative_path)):
+                installed_files[relative_path] = {'crc': info.CRC, 'size': info.file_size}
+                n_unchanged += 1
+                continue
+            
             # Create necessary directories
             os.makedirs(os.path.dirname(dest_file_path), exist_ok=True)
             
             # Extract file to destination
-            with zip_f.open(file_path) as source, open(dest_file_path, 'wb') as target:
-                target.write(source.read())
-            
-            print("Extracted: " + dest_file_path)
+            with zip_f.open(info) as source:
+                writeFileAtomically(dest_file_path, lambda f: shutil.copyfileobj(source, f, CHUNK_SIZE))
+            installed_files[relative_path] = {'crc': info.CRC, 'size': info.file_size}
             
+            print("Updated: " + dest_file_path)
+    
+    saveManifest(dest_path, manifest)
+    print(f"{n_unchanged} files were already up to date.")
     
     os.remove(tmp_fn)
 
+# Returns the version installed in the given folder, by default the folder of the
+# scripts, as recorded in the manifest by the last update. Installs that have not been
+# updated yet have no manifest, and the version is then read from sentinel_alerts.py.
+def getInstalledVersion(folder=SCRIPT_FOLDER):
+    version = loadManifest(os.path.abspath(folder)).get('version', "")
+    if version == "":
+        with open(os.path.join(folder, "sentinel_alerts.py"), 'r') as f:
+            version = getVersionString(f.read())
+    return version
+
 def update(settings_dict):
     
     # First we check if an update is needed.
     need_update = checkForUpdate(settings_dict)
     
     if need_update:
-        # Get current directory
-        script_directory = os.path.abspath('')
         print("Update needed. Downloading archive from '" + settings_dict['repo-url'] + "'")
-        print("and extracting to '" + script_directory + "'")
-        downloadRepoTo(settings_dict['repo-url'], script_directory)
-        print("Successfully updated sentinel_alerts!")
\ No newline at end of file
+        print("and extracting to '" + SCRIPT_FOLDER + "'")
+        # Verify the archive against the published digest if there is one
+        sha256 = None
+        if settings_dict.get('repo-sha256-url'):
+            sha256 = getPublishedDigest(settings_dict['repo-sha256-url'], settings_dict['update-timeout'])
+        downloadRepoTo(settings_dict['repo-url'], SCRIPT_FOLDER, sha256=sha256)
+        print("Successfully updated sentinel_alerts!")
+
+# Starts the update in a detached background process, so that the caller can exit right
+# away instead of waiting for the network. The process writes its output to the file
+# given by the update-log-fn key. Nothing is started if the check interval has not
+# passed yet.
+def updateInBackground(settings_dict):
+    if not checkIsDue(settings_dict):
+        return None
+
+    from post_render import detachedProcessOptions
+
+    with open(settings_dict['update-log-fn'], 'a') as log:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], cwd=SCRIPT_FOLDER, stdin=subprocess.DEVNULL, stdout=log, stderr=log, **detachedProcessOptions())
+
+# Running this file directly performs the update check in the foreground. This is what
+# the background process started by updateInBackground does.
+if __name__ == "__main__":
+    from file_functions import loadSettings
+    update(loadSettings())
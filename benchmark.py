@@ -0,0 +1,368 @@
+# Benchmarks for the time critical parts of sentinel_alerts
+
+from alert_parser import parseAlert
+from file_functions import loadSettings, readInputFile, formatAlertDict, formatAlertRecord, generateReportString, generateFileName
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FLAVOURS = ["sentinel", "sentinel_v2", "defender"]
+STAGES = ["parse", "render", "name", "write"]
+DEFAULT_BASELINE_FN = os.path.join(SCRIPT_FOLDER, "benchmark_baseline.json")
+DEFAULT_PARITY_FN = os.path.join(SCRIPT_FOLDER, "parity_reference.json")
+EXAMPLE_FN = "example_output.txt"
+PARITY_SIZES = [1, 10, 100]
+PARITY_ALERTS = 5
+# Alerts mixing the keys of several sources, which are shown in full whatever type they
+# are detected as
+MIXED_ALERTS = [
+    ["Asset key: h", "user: alice, bob"],
+    ["Asset key: h", "Info description: d", "Title: T"],
+    ["Info description: d", "dvc: h1"],
+    ["dvc: h1", "Description: d", "Process name: cmd.exe"],
+]
+PROCESS_TABLE_KEYS = ("Process", "Process exec", "Process path", "Process hash sha256", "Process owner", "Parent process exec")
+CUSTOMER_NAMES = {"alpha": "Alpha Industries", "beta": "Beta Shipping", "gamma": "Gamma Health", "delta": "Delta Energy"}
+
+# Builds the lines of a multi-kilobyte alert: a Sentinel v2 style description that
+# continues over n_lines lines followed by Defender style process lists with n_lines
+# comma separated entries.
+def buildLargeAlert(n_lines):
+    lines = ["OCD_INC1234567 1 event", "ID: 9a9a9a9a-9a9a-9a9a-9a9a-9a9a9a9a9a9a", "@timestamp: 2023-10-08T16:21:01.010Z"]
+    lines.append("CustomerName: Customer Name")
+    lines.append("Description: Start of a long description")
+    lines += [f"continuation line number {i} of the description with some more text" for i in range(n_lines)]
+    lines.append("Process: " + ", ".join(f"cmd.exe /c task{i}" for i in range(n_lines)))
+    lines.append("Process exec: " + ", ".join("cmd.exe" for i in range(n_lines)))
+    lines.append("Process hash sha256: " + ", ".join("6a946d70551b54494c40fccae3221e46124cac45d66f4542eedf09f6cbe337fd" for i in range(n_lines)))
+    lines.append("dvc: " + ", ".join(f"host-{i}.example.com" for i in range(n_lines)))
+    return lines
+
+def randomWord(rng, length=8):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(length))
+
+def randomSha256(rng):
+    return "".join(rng.choice("0123456789abcdef") for _ in range(64))
+
+def randomTimestamp(rng):
+    return f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}Z"
+
+# Generates the lines of a synthetic alert of the given flavour. The size is the number
+# of extra fields for Sentinel alerts, the number of description lines for Sentinel v2
+# alerts and the number of processes and hosts for Defender alerts.
+def generateAlert(flavour, size, rng, case_number):
+    lines = [f"OCD_INC{case_number} 1 event", f" ID: {rng.getrandbits(128):032x}", "@timestamp: " + randomTimestamp(rng)]
+    lines.append("CustomerName: " + rng.choice(list(CUSTOMER_NAMES.values())) + " AS")
+
+    if flavour in ("sentinel", "sentinel_v2"):
+        host = randomWord(rng) + ".example.com"
+        lines += ["Asset: " + host, "Asset key: " + host, "Asset user: " + randomWord(rng) + "@example.com"]
+        lines.append(f"Asset ipv4: 10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}")
+        lines.append(f"Info sub name: PAT-{rng.randint(100, 999)}")
+        lines.append(f"Info mitre ID: T{rng.randint(1000, 1999)}")
+        if flavour == "sentinel":
+            lines.append("Info description: " + " ".join(randomWord(rng) for _ in range(10)))
+            lines += [f"Info field {i}: " + randomWord(rng, 16) for i in range(size)]
+            lines += ["Parent process: explorer.exe", "Parent process commandline: explorer.exe /factory"]
+            lines += ["Process name: cmd.exe", "Process path: C:\\Windows\\System32\\cmd.exe", "Process commandline: cmd.exe /c " + randomWord(rng), "Process sha256: " + randomSha256(rng)]
+            lines.append("Mailbox address: " + randomWord(rng) + "@example.com")
+        else:
+            lines.append("Description: " + " ".join(randomWord(rng) for _ in range(10)))
+            lines += [" ".join(randomWord(rng) for _ in range(10)) for _ in range(size)]
+            lines.append("Incident URL: https://portal.example.com/incidents/" + str(case_number))
+    elif flavour == "defender":
+        lines.append(f"Incident ID: {rng.randint(1000, 99999)}")
+        lines.append("Incident title: " + " ".join(randomWord(rng) for _ in range(6)))
+        lines.append("Category: Execution")
+        lines.append("Title: " + " ".join(randomWord(rng) for _ in range(6)))
+        lines.append("dvc: " + ", ".join(randomWord(rng) + ".example.com" for _ in range(size)))
+        users = [randomWord(rng) for _ in range(size)]
+        lines.append("user: " + ", ".join(users))
+        lines.append("Process: " + ", ".join("powershell.exe -enc " + randomWord(rng, 40) for _ in range(size)))
+        lines.append("Process exec: " + ", ".join("powershell.exe" for _ in range(size)))
+        lines.append("Process path: " + ", ".join("C:\\Windows\\System32\\powershell.exe" for _ in range(size)))
+        lines.append("Process hash sha256: " + ", ".join(randomSha256(rng) for _ in range(size)))
+        lines.append("Process owner: " + ", ".join(users))
+        lines.append("Parent process exec: " + ", ".join("explorer.exe" for _ in range(size)))
+        lines.append(f"ip: 10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}")
+        lines.append("Mailbox address: " + users[0] + "@example.com")
+    else:
+        raise ValueError("ERROR in generateAlert:\nUnknown flavour '" + flavour + "'. Use one of " + ", ".join(FLAVOURS))
+
+    lines.append("ServiceRegion: NO")
+    return lines
+
+# Builds the lines of an alert with a random third of the keys of a Defender alert and
+# of a Sentinel alert of either version, keeping the first line of every key. The columns of the Defender process
+# table are kept or left out together.
+def generateMixedAlert(size, rng, case_number):
+    lines = generateAlert(FLAVOURS[0], size, rng, case_number)[:4]
+    with_table = rng.random() < 1/3
+    keys = set(PROCESS_TABLE_KEYS)
+    for flavour in ("defender", rng.choice(FLAVOURS[:2])):
+        for line in generateAlert(flavour, size, rng, case_number)[4:-1]:
+            key = line.split(": ", 1)[0]
+            if flavour == "defender" and key in PROCESS_TABLE_KEYS:
+                if with_table:
+                    lines.append(line)
+            elif ": " in line and key not in keys and rng.random() < 1/3:
+                keys.add(key)
+                lines.append(line)
+    lines.append("ServiceRegion: NO")
+    return lines
+
+# Returns the best time in seconds per call of function(argument) over repeat rounds
+# of number calls each.
+def timeFunction(function, argument, number, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function(argument)
+        best = min(best, (time.perf_counter() - start)/number)
+    return best
+
+# Prints the parse time per alert for alerts of increasing size.
+def benchmarkParser(sizes, number, repeat):
+    print("Lines    Size (kB)    Parse time per alert (us)")
+    for n_lines in sizes:
+        lines = buildLargeAlert(n_lines)
+        size = sum(len(line) + 1 for line in lines)/1024
+        seconds = timeFunction(parseAlert, lines, number, repeat)
+        print(f"{n_lines:<8} {size:<12.1f} {seconds*1e6:.1f}")
+
+# Times each stage of the report path on n_alerts generated alerts of every flavour and
+# size, and returns a dictionary from "<flavour>/<size>/<stage>" to the best time per
+# alert in microseconds.
+def benchmarkSuite(sizes, n_alerts, repeat, seed):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, "code_names.json"), "w") as f:
+            json.dump(CUSTOMER_NAMES, f)
+        settings_path = os.path.join(folder, "settings.conf")
+        with open(settings_path, "w") as f:
+            json.dump({"output-folder": folder, "output-filename": "output.txt", "code-names": "code_names.json", "text-program-path": "", "auto-update": False}, f)
+        config = loadSettings(settings_path)
+
+        for flavour in FLAVOURS:
+            for size in sizes:
+                rng = random.Random(f"{seed}/{flavour}/{size}")
+                alerts = [generateAlert(flavour, size, rng, 1000000 + i) for i in range(n_alerts)]
+
+                best = {stage: float("inf") for stage in STAGES}
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    records = [formatAlertRecord(lines) for lines in alerts]
+                    best["parse"] = min(best["parse"], time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    reports = [generateReportString(record) for record in records]
+                    best["render"] = min(best["render"], time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    file_names = [generateFileName(record, config) for record in records]
+                    best["name"] = min(best["name"], time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    for file_name, report in zip(file_names, reports):
+                        with open(os.path.join(folder, file_name), "w", encoding="utf8") as f:
+                            print(report, file=f, end='')
+                    best["write"] = min(best["write"], time.perf_counter() - start)
+
+                for stage in STAGES:
+                    results[f"{flavour}/{size}/{stage}"] = best[stage]/n_alerts*1e6
+    return results
+
+# Prints the results of the suite next to the baseline and returns False if any result
+# is slower than the baseline by more than the threshold, given as a fraction.
+def compareWithBaseline(results, baseline, threshold):
+    ok = True
+    print(f"{'Benchmark':<28} {'us/alert':>10} {'alerts/s':>10} {'baseline':>10} {'change':>8}")
+    for name, us in results.items():
+        line = f"{name:<28} {us:>10.1f} {1e6/us:>10.0f}"
+        if name in baseline:
+            change = us/baseline[name] - 1
+            line += f" {baseline[name]:>10.1f} {change*100:>+7.1f}%"
+            if change > threshold:
+                line += "  FAIL"
+                ok = False
+        print(line)
+    return ok
+
+# Returns the parsed alert dictionary and the report of every parity input by name. The
+# inputs are example_output.txt, the MIXED_ALERTS and PARITY_ALERTS seeded alerts of
+# every flavour and size in PARITY_SIZES, and as many mixing the keys of the flavours.
+def parityOutputs():
+    inputs = {EXAMPLE_FN: readInputFile(os.path.join(SCRIPT_FOLDER, EXAMPLE_FN))}
+    for flavour in FLAVOURS:
+        for size in PARITY_SIZES:
+            rng = random.Random(f"parity/{flavour}/{size}")
+            for i in range(PARITY_ALERTS):
+                inputs[f"{flavour}/{size}/{i}"] = generateAlert(flavour, size, rng, 4000000 + i)
+    header = ["OCD_INC4100000 1 event", " ID: 0", "@timestamp: 2023-10-08T16:21:01.010Z", "CustomerName: Alpha Industries AS"]
+    for i, body in enumerate(MIXED_ALERTS):
+        inputs[f"mixed/{i}"] = header + body + ["ServiceRegion: NO"]
+    for size in PARITY_SIZES:
+        rng = random.Random(f"parity/mixed/{size}")
+        for i in range(PARITY_ALERTS):
+            inputs[f"mixed/{size}/{i}"] = generateMixedAlert(size, rng, 4100000 + i)
+    return {name: {'alert': formatAlertDict(lines), 'report': generateReportString(formatAlertRecord(lines))} for name, lines in inputs.items()}
+
+def outputDigest(output):
+    return hashlib.sha256(json.dumps(output, sort_keys=True).encode("utf8")).hexdigest()
+
+# Compares the parsed alerts and reports with the reference, which holds a digest of the
+# outputs of every input and the outputs of example_output.txt in full, so that changes
+# to those can be shown. Returns False if any output differs.
+def checkParity(outputs, reference):
+    ok = True
+    for name, output in outputs.items():
+        if outputDigest(output) == reference['digests'].get(name):
+            continue
+        ok = False
+        print("FAIL: " + name + " differs from the reference.")
+        if name == EXAMPLE_FN:
+            expected = reference['example']
+            for key in sorted(set(expected['alert']) | set(output['alert'])):
+                if expected['alert'].get(key) != output['alert'].get(key):
+                    print(f"  alert[{key!r}]: {expected['alert'].get(key)!r} -> {output['alert'].get(key)!r}")
+            for line in difflib.unified_diff(expected['report'].splitlines(), output['report'].splitlines(), "reference", "current", lineterm=""):
+                print("  " + line)
+    if ok:
+        print(f"All {len(outputs)} parsed alerts and reports match the reference.")
+    return ok
+
+# Parses the stderr output of `python -X importtime` into a dictionary from module name
+# to cumulative import time in microseconds.
+def parseImportTimes(stderr):
+    import_times = {}
+    for line in stderr.splitlines():
+        m = re.match(r"^import time:\s+[0-9]+ \|\s+([0-9]+) \|( *)(\S+)$", line)
+        if m:
+            import_times[m.group(3)] = int(m.group(1))
+    return import_times
+
+# Runs sentinel_alerts.py from scratch on the example alert in a temporary output folder
+# with auto-update turned off and returns the wall time in seconds together with the
+# import times of the run.
+def runColdStart(folder):
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, "-X", "importtime", os.path.join(SCRIPT_FOLDER, "sentinel_alerts.py"), "--settings", os.path.join(folder, "settings.conf")], cwd=folder, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if res.returncode != 0:
+        raise Exception("ERROR in runColdStart:\nsentinel_alerts.py failed with\n" + res.stderr[-2000:])
+    return wall_time, parseImportTimes(res.stderr)
+
+# Measures the cold start of the report path and returns False if the best wall time
+# is above the budget or if any of the forbidden modules were imported.
+def benchmarkStartup(budget_ms, forbidden, repeat):
+    with tempfile.TemporaryDirectory() as folder:
+        # The editor is replaced by a Python process that does nothing
+        settings_dict = {"output-folder": folder, "output-filename": "output.txt", "code-names": os.path.join(folder, "code_names.json"), "text-program-path": "\"" + sys.executable + "\" -c pass", "auto-update": False}
+        with open(os.path.join(folder, "settings.conf"), "w") as f:
+            json.dump(settings_dict, f)
+        with open(os.path.join(folder, "code_names.json"), "w") as f:
+            json.dump({"example-code": "Customer Name"}, f)
+
+        best = float("inf")
+        for _ in range(repeat):
+            with open(os.path.join(SCRIPT_FOLDER, "example_output.txt"), "r") as source, open(os.path.join(folder, "output.txt"), "w") as target:
+                target.write(source.read())
+            for fn in os.listdir(folder):
+                if fn.endswith(".md"):
+                    os.remove(os.path.join(folder, fn))
+            wall_time, import_times = runColdStart(folder)
+            best = min(best, wall_time)
+
+    print(f"Cold start of report path: {best*1000:.1f} ms (budget {budget_ms} ms)")
+    print("Slowest imports (cumulative us):")
+    for name, us in sorted(import_times.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {us:>8}  {name}")
+
+    # Modules imported by the interpreter itself, e.g. through .pth files in
+    # site-packages, are not the fault of sentinel_alerts.
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True)
+    interpreter_imports = parseImportTimes(res.stderr)
+
+    ok = True
+    imported = [name for name in forbidden if name in import_times and name not in interpreter_imports]
+    if imported:
+        print("FAIL: imported modules that should be lazy: " + ", ".join(imported))
+        ok = False
+    if best*1000 > budget_ms:
+        print("FAIL: cold start is over budget.")
+        ok = False
+    return ok
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for sentinel_alerts.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parse_parser = subparsers.add_parser("parse", help="Benchmark the alert parser.")
+    parse_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Number of continuation lines and process entries in the generated alerts.")
+    parse_parser.add_argument("--number", type=int, default=100, help="Number of parses per timing round.")
+    parse_parser.add_argument("--repeat", type=int, default=5, help="Number of timing rounds.")
+
+    startup_parser = subparsers.add_parser("startup", help="Check the cold start time of the report path against a budget.")
+    startup_parser.add_argument("--budget-ms", type=float, default=250, help="Maximum allowed wall time of a cold start in milliseconds.")
+    startup_parser.add_argument("--forbid", nargs="*", default=["requests", "zipfile", "auto_update"], help="Modules that must not be imported when auto-update is off.")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="Number of cold starts to take the best time of.")
+
+    suite_parser = subparsers.add_parser("suite", help="Time parsing, rendering, naming and writing of generated alerts of every flavour.")
+    suite_parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="Sizes of the generated alerts, see generateAlert.")
+    suite_parser.add_argument("--alerts", type=int, default=200, help="Number of alerts of each flavour and size.")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="Number of timing rounds.")
+    suite_parser.add_argument("--seed", type=int, default=0, help="Seed of the alert generator.")
+    suite_parser.add_argument("--baseline", default=DEFAULT_BASELINE_FN, help="File with the baseline results.")
+    suite_parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    suite_parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown relative to the baseline, as a fraction.")
+
+    parity_parser = subparsers.add_parser("parity", help="Check the parsed alerts and reports of example_output.txt and generated alerts against a reference.")
+    parity_parser.add_argument("--reference", default=DEFAULT_PARITY_FN, help="File with the reference outputs.")
+    parity_parser.add_argument("--save-reference", action="store_true", help="Store the current outputs as the new reference, after an intended change.")
+
+    args = parser.parse_args(argv)
+
+    if args.benchmark == "parse":
+        benchmarkParser(args.sizes, args.number, args.repeat)
+    elif args.benchmark == "startup":
+        if not benchmarkStartup(args.budget_ms, args.forbid, args.repeat):
+            sys.exit(1)
+    elif args.benchmark == "suite":
+        results = benchmarkSuite(args.sizes, args.alerts, args.repeat, args.seed)
+        baseline = {}
+        if os.path.exists(args.baseline) and not args.save_baseline:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        ok = compareWithBaseline(results, baseline, args.threshold)
+        if args.save_baseline:
+            with open(args.baseline, "w") as f:
+                print(json.dumps(results, indent=4), file=f, end='')
+            print("Saved baseline to " + args.baseline)
+        elif not ok:
+            sys.exit(1)
+    elif args.benchmark == "parity":
+        outputs = parityOutputs()
+        if args.save_reference:
+            reference = {'digests': {name: outputDigest(output) for name, output in outputs.items()}, 'example': outputs[EXAMPLE_FN]}
+            with open(args.reference, "w", encoding="utf8") as f:
+                print(json.dumps(reference, indent=4, sort_keys=True), file=f)
+            print("Saved reference to " + args.reference)
+        else:
+            with open(args.reference, "r", encoding="utf8") as f:
+                reference = json.load(f)
+            if not checkParity(outputs, reference):
+                sys.exit(1)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,130 @@
+# Regenerates the reports of an archive of raw alert outputs, e.g. after the report
+# layout has changed. The input is a folder or a .zip file of raw outputs, each holding
+# one or more alerts. Parsing and rendering are spread over a pool of processes, while
+# the reports are written by the main process in the sorted order of the inputs. A
+# checkpoint file in the destination folder records the finished inputs, so that an
+# interrupted run continues where it stopped.
+
+from atomic_write import writeFileAtomically
+from file_functions import loadSettings, splitAlertLines, formatAlertRecord, generateReportString, generateFileName
+from input_reader import iterBytesLines, iterLines
+from report_writer import COLLISION_POLICIES, ReportWriter
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import sys
+import zipfile
+
+CHECKPOINT_FN = ".bulk_checkpoint.json"
+DEFAULT_CHUNK_SIZE = 16
+
+# Returns the sorted names of the raw outputs in a folder, relative to the folder, or in
+# a .zip file.
+def listInputs(source_path):
+    if zipfile.is_zipfile(source_path):
+        with zipfile.ZipFile(source_path, 'r') as zip_f:
+            return sorted(info.filename for info in zip_f.infolist() if not info.is_dir())
+
+    names = []
+    for folder, _, fns in os.walk(source_path):
+        for fn in fns:
+            names.append(os.path.relpath(os.path.join(folder, fn), source_path))
+    return sorted(names)
+
+# Returns a list of (report file name, report) pairs for the alerts in an iterable of
+# lines read from the input with the given name.
+def renderLines(lines, name, config):
+    reports = []
+    for alert_lines in splitAlertLines(lines, name):
+        record = formatAlertRecord(alert_lines)
+        reports.append((generateFileName(record, config), generateReportString(record)))
+    return reports
+
+# Parses and renders all alerts of a chunk of inputs. Runs in the worker processes and
+# returns, for each input, its name, a list of (report file name, report) pairs and an
+# error message or None. The settings are loaded from the given path once per worker.
+def renderChunk(source_path, names, settings_path):
+    config = loadSettings(settings_path)
+    zip_f = zipfile.ZipFile(source_path, 'r') if zipfile.is_zipfile(source_path) else None
+    results = []
+    try:
+        for name in names:
+            try:
+                # Inputs are read with the same encoding detection as output.txt
+                if zip_f is not None:
+                    reports = renderLines(iterBytesLines(zip_f.read(name)), name, config)
+                else:
+                    reports = renderLines(iterLines(os.path.join(source_path, name)), name, config)
+                results.append((name, reports, None))
+            except Exception as e:
+                results.append((name, [], str(e)))
+    finally:
+        if zip_f is not None:
+            zip_f.close()
+    return results
+
+def loadCheckpoint(path):
+    try:
+        with open(path, 'r', encoding="utf8") as f:
+            return set(json.load(f)['completed'])
+    except (OSError, ValueError, KeyError):
+        return set()
+
+def saveCheckpoint(path, completed):
+    data = json.dumps({'completed': sorted(completed)}).encode("utf8")
+    writeFileAtomically(path, lambda f: f.write(data))
+
+# Regenerates the reports of all inputs in source_path into dest_path and returns the
+# number of written reports, the number of existing reports kept by the skip collision
+# policy and the list of (input name, error) for failed inputs. Existing reports are
+# handled according to the collision policy of the ReportWriter.
+# The code names are those of the settings file at settings_path.
+def bulkRender(source_path, dest_path, settings_path, jobs=None, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, collision="overwrite"):
+    writer = ReportWriter(dest_path, collision)
+    checkpoint_path = os.path.join(dest_path, CHECKPOINT_FN)
+    completed = set() if restart else loadCheckpoint(checkpoint_path)
+
+    names = [name for name in listInputs(source_path) if name not in completed]
+    chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+    print(f"{len(names)} inputs to render, {len(completed)} already done.")
+
+    failures = []
+    with writer, ProcessPoolExecutor(max_workers=jobs) as executor:
+        # map returns the results in the order of the chunks, so the reports are written
+        # in the same order on every run no matter which worker finishes first.
+        results = executor.map(renderChunk, [source_path]*len(chunks), chunks, [settings_path]*len(chunks))
+        for chunk_results in results:
+            for name, reports, error in chunk_results:
+                if error is not None:
+                    failures.append((name, error))
+                    continue
+                for output_fn, report in reports:
+                    writer.write(output_fn, report)
+                completed.add(name)
+            # Only inputs whose reports are safely on disk are marked as done
+            writer.flush()
+            saveCheckpoint(checkpoint_path, completed)
+
+    return writer.n_written, writer.n_skipped, failures
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Regenerate the reports of a folder or .zip file of raw alert outputs.")
+    parser.add_argument("source", help="Folder or .zip file with raw alert outputs.")
+    parser.add_argument("destination", help="Folder to write the reports to.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes. Defaults to the number of cores.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of inputs handed to a worker at a time.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and render all inputs again.")
+    parser.add_argument("--collision", choices=COLLISION_POLICIES, default="overwrite", help="What to do with reports that already exist in the destination folder.")
+    args = parser.parse_args(argv)
+
+    settings_dict = loadSettings()
+    n_reports, n_kept, failures = bulkRender(args.source, args.destination, settings_dict.path, args.jobs, args.chunk_size, args.restart, args.collision)
+
+    for name, error in failures:
+        print(f"Failed to render {name}:\n{error}\n")
+    print(f"Wrote {n_reports} reports" + (f", kept {n_kept} existing" if n_kept else "") + f", {len(failures)} inputs failed.")
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,232 @@
+# Settings of sentinel_alerts
+#
+# settings.conf is looked for next to the scripts first and in the current folder
+# second, so that the scripts can be started from anywhere. The settings are checked
+# against SETTINGS_SPEC when they are loaded, so that a missing or mistyped setting is
+# reported right away instead of halfway through a run, and missing optional settings
+# get their defaults. The code names are loaded at the same time and their index is
+# built once.
+#
+# The result is a read-only Config, which is used like the dictionary of settings it was
+# made from and shared by all modules through loadConfig. A snapshot of it is pickled
+# next to settings.conf together with the modification times of the files it was made
+# from, so later runs skip the checks and the index construction as long as the files
+# are unchanged.
+
+from atomic_write import writeFileAtomically
+from customer_codes import CustomerCodeIndex
+
+from collections.abc import Mapping
+from types import MappingProxyType
+import json
+import os
+import pickle
+import sys
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FN = "settings.conf"
+SNAPSHOT_FN = ".settings_snapshot.pickle"
+# Changed whenever Config or SETTINGS_SPEC changes, so that old snapshots are not used
+SNAPSHOT_VERSION = 1
+
+# Markers for settings that must be given and for settings without a default value
+REQUIRED = object()
+OPTIONAL = object()
+NUMBER = (int, float)
+
+# Type and default value of each setting. Settings marked as OPTIONAL are left out when
+# they are not given, as the code using them tells apart whether they are set.
+SETTINGS_SPEC = {
+    'output-folder': (str, REQUIRED),
+    'output-filename': (str, REQUIRED),
+    'code-names': (str, REQUIRED),
+    'text-program-path': ((str, list), REQUIRED),
+    'auto-update': (bool, True),
+    'remote-url': (str, OPTIONAL),
+    'repo-url': (str, OPTIONAL),
+    'repo-sha256-url': ((str, type(None)), OPTIONAL),
+    'check-interval': (NUMBER, 4),
+    'last-check-fn': (str, "last_check.dat"),
+    'update-timeout': (NUMBER, 5),
+    'update-state-fn': (str, "update_state.json"),
+    'update-log-fn': (str, "update.log"),
+    'daemon-port': (int, 47474),
+    'daemon-poll-interval': (NUMBER, 0.5),
+    'daemon-render-on-save': (bool, True),
+    'clipboard-command': ((str, list), OPTIONAL),
+    'store-alerts': (bool, True),
+    'alert-database': (str, OPTIONAL),
+    'report-cache': (bool, True),
+    'report-cache-size': (int, 256),
+    'report-collision': (str, "suffix"),
+    'report-fsync': (bool, True),
+    'profile': (bool, False),
+    'profile-log': (str, OPTIONAL),
+    'cprofile-path': (str, OPTIONAL),
+}
+# Settings that are only needed when updating is turned on
+UPDATE_SETTINGS = ('remote-url', 'repo-url')
+# Settings holding paths, which are taken relative to the folder of settings.conf
+PATH_SETTINGS = ('output-folder', 'code-names', 'last-check-fn', 'update-state-fn', 'update-log-fn', 'alert-database', 'profile-log', 'cprofile-path')
+
+# Read-only mapping of the settings together with the index of the code names
+class Config(Mapping):
+    __slots__ = ('settings', 'code_index', 'path', 'sources')
+
+    def __init__(self, settings, code_index, path, sources):
+        object.__setattr__(self, 'settings', MappingProxyType(settings))
+        object.__setattr__(self, 'code_index', code_index)
+        object.__setattr__(self, 'path', path)
+        # Signatures of the files the settings were made from by path, see fileSignature
+        object.__setattr__(self, 'sources', sources)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ERROR in Config:\nThe settings are read-only.")
+
+    # The read-only view of the settings can not be pickled, so the snapshot holds a copy
+    def __reduce__(self):
+        return (Config, (dict(self.settings), self.code_index, self.path, self.sources))
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def __iter__(self):
+        return iter(self.settings)
+
+    def __len__(self):
+        return len(self.settings)
+
+    def __repr__(self):
+        return f"Config({dict(self.settings)!r})"
+
+    # Returns True if none of the files the settings were made from has changed
+    def isCurrent(self):
+        return all(fileSignature(path) == signature for path, signature in self.sources.items())
+
+# Returns the modification time and size of a file, or None if it does not exist
+def fileSignature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Returns the path of the settings file. A bare file name is looked for in the script
+# folder and then in the current folder, while a path is used as it is.
+def findSettings(filename=SETTINGS_FN):
+    if os.path.dirname(filename):
+        return os.path.abspath(filename)
+    for folder in (SCRIPT_FOLDER, os.path.abspath('')):
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            return path
+    raise ValueError(f"ERROR in findSettings.\nCould not find {filename} in {SCRIPT_FOLDER} or {os.path.abspath('')}.")
+
+# Checks the settings against SETTINGS_SPEC and returns them with the defaults filled in
+# and the paths made absolute. All problems are reported together.
+def validateSettings(settings_dict, settings_folder):
+    problems = []
+    values = {}
+    for key, (types, default) in SETTINGS_SPEC.items():
+        if key in settings_dict:
+            value = settings_dict[key]
+            if not hasType(value, types):
+                problems.append(f"'{key}' should be {typeNames(types)}, not {json.dumps(value)}")
+                continue
+            values[key] = value
+        elif default is REQUIRED:
+            problems.append(f"'{key}' is missing")
+        elif default is not OPTIONAL:
+            values[key] = default
+
+    if values.get('auto-update'):
+        for key in UPDATE_SETTINGS:
+            if key not in values:
+                problems.append(f"'{key}' is needed when 'auto-update' is on")
+    if 'report-collision' in values:
+        from report_writer import COLLISION_POLICIES
+        if values['report-collision'] not in COLLISION_POLICIES:
+            problems.append("'report-collision' should be one of " + ", ".join(COLLISION_POLICIES))
+    if problems:
+        raise ValueError("ERROR in validateSettings:\n" + "\n".join(problems))
+
+    unknown = sorted(key for key in settings_dict if key not in SETTINGS_SPEC)
+    if unknown:
+        print("Warning: unknown settings " + ", ".join(unknown), file=sys.stderr)
+    # Settings not in the spec are kept, so that nothing set by hand is lost
+    for key in unknown:
+        values[key] = settings_dict[key]
+
+    for key in PATH_SETTINGS:
+        if key in values and values[key] != "-":
+            values[key] = os.path.normpath(os.path.join(settings_folder, values[key]))
+    return values
+
+def hasType(value, types):
+    types = types if isinstance(types, tuple) else (types,)
+    # bool is a subclass of int, so true and false would pass as numbers
+    if isinstance(value, bool):
+        return bool in types
+    return isinstance(value, types)
+
+def typeNames(types):
+    types = types if isinstance(types, tuple) else (types,)
+    if float in types:
+        types = tuple(t for t in types if t is not int)
+    names = {bool: "true or false", int: "a whole number", float: "a number", str: "a string", list: "a list", type(None): "null"}
+    return " or ".join(names.get(t, t.__name__) for t in types)
+
+# Reads and checks the settings and code names and builds a new Config
+def buildConfig(settings_path):
+    with open(settings_path, 'r', encoding="utf8") as f:
+        try:
+            settings_dict = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"ERROR in buildConfig.\n{settings_path} is not valid JSON: {e}")
+    values = validateSettings(settings_dict, os.path.dirname(settings_path))
+
+    code_path = values['code-names']
+    if not os.path.exists(code_path):
+        raise ValueError(f"ERROR in buildConfig.\nPath: {code_path} does not exist.")
+    with open(code_path, 'r', encoding="utf8") as f:
+        code_index = CustomerCodeIndex(json.load(f))
+
+    sources = {path: fileSignature(path) for path in (settings_path, code_path)}
+    return Config(values, code_index, settings_path, sources)
+
+def loadSnapshot(snapshot_path, settings_path):
+    try:
+        with open(snapshot_path, 'rb') as f:
+            version, config = pickle.load(f)
+    except Exception:
+        return None
+    if version != SNAPSHOT_VERSION or not isinstance(config, Config) or config.path != settings_path or not config.isCurrent():
+        return None
+    return config
+
+# Writes the snapshot through a temporary file. A folder that can not be written to, or
+# a snapshot lost in a crash, only means that the next run builds the settings again.
+def saveSnapshot(snapshot_path, config):
+    try:
+        writeFileAtomically(snapshot_path, lambda f: pickle.dump((SNAPSHOT_VERSION, config), f, protocol=pickle.HIGHEST_PROTOCOL), fsync=False)
+    except OSError:
+        pass
+
+# Configs loaded in this process by settings path
+loaded_configs = {}
+
+# Returns the Config for the settings file, which is shared by every caller in the
+# process until the settings or code names change.
+def loadConfig(filename=SETTINGS_FN):
+    settings_path = findSettings(filename)
+    config = loaded_configs.get(settings_path)
+    if config is not None and config.isCurrent():
+        return config
+
+    snapshot_path = os.path.join(os.path.dirname(settings_path), SNAPSHOT_FN)
+    config = loadSnapshot(snapshot_path, settings_path)
+    if config is None:
+        config = buildConfig(settings_path)
+        saveSnapshot(snapshot_path, config)
+    loaded_configs[settings_path] = config
+    return config
@@ -0,0 +1,81 @@
+# Index for looking up the code name of a customer from the customer name in an alert
+
+from collections import deque
+
+# Aho-Corasick automaton over the lowercased customer names in a code dictionary. The
+# automaton is built once and finds every customer name contained in a string in a
+# single pass over that string, regardless of the number of customers.
+class CustomerCodeIndex:
+
+    def __init__(self, code_dictionary):
+        # Each state has a dictionary of transitions, a failure link and a list of
+        # (code, name length) pairs for the names that end in that state.
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+
+        for code, name in code_dictionary.items():
+            name = name.lower()
+            # An empty name would match every customer, so it is left out of the index.
+            if name == "":
+                continue
+            state = 0
+            for character in name:
+                next_state = self.transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions.append({})
+                    self.failures.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][character] = next_state
+                state = next_state
+            self.outputs[state].append((code, len(name)))
+
+        # Breadth first construction of the failure links
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(character, 0)
+                self.failures[next_state] = failure if failure != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failures[next_state]]
+
+    # Returns a list of (code, start, end) tuples for every occurrence of a customer name
+    # in the given string.
+    def findAll(self, customer_name):
+        matches = []
+        state = 0
+        for end, character in enumerate(customer_name.lower(), 1):
+            while state and character not in self.transitions[state]:
+                state = self.failures[state]
+            state = self.transitions[state].get(character, 0)
+            for code, length in self.outputs[state]:
+                matches.append((code, end - length, end))
+        return matches
+
+    # Returns the code of the customer whose name is contained in the given string. If
+    # several names are contained, the longest and therefore most specific name wins, as
+    # long as the others are only found inside it, like "Bank" in "Nordic Bank". Returns
+    # None if no name matches and raises a ValueError listing the candidates if several
+    # codes share the longest matching name length or a shorter name is found outside of
+    # the longest one.
+    def lookup(self, customer_name):
+        matches = self.findAll(customer_name)
+        if not matches:
+            return None
+
+        longest = max(end - start for _, start, end in matches)
+        codes = sorted({code for code, start, end in matches if end - start == longest})
+        if len(codes) > 1:
+            raise ValueError("ERROR in CustomerCodeIndex.lookup:\n\"" + customer_name + "\" matches the code names " + ", ".join(codes) + " equally well.")
+
+        spans = [(start, end) for code, start, end in matches if code == codes[0]]
+        outside = sorted({code for code, start, end in matches
+                          if code != codes[0] and not any(span_start <= start and end <= span_end for span_start, span_end in spans)})
+        if outside:
+            raise ValueError("ERROR in CustomerCodeIndex.lookup:\n\"" + customer_name + "\" matches the code names " + ", ".join(codes + outside) + ", which are not part of one another.")
+        return codes[0]
@@ -0,0 +1,63 @@
+# Daily digest of the alerts per customer, built from the counts the alert database keeps
+# up to date as alerts are processed, so no reports have to be read again.
+
+from alert_store import AlertStore, databasePath
+from file_functions import loadSettings
+from report_templates import renderTemplate
+
+from datetime import datetime, timezone
+import argparse
+import sys
+
+DEFAULT_TOP = 10
+
+# Titles of the sections of a customer in the digest, in the order they are shown
+DIGEST_SECTIONS = (
+    ('pattern', "Patterns"),
+    ('mitre', "MITRE IDs"),
+    ('host', "Hosts"),
+    ('user', "Users"),
+)
+
+# Collects the digest rows of a day, as returned by AlertStore.digest, in the form used
+# by the digest template. Each section lists at most top values.
+def digestContext(day, rows, top=DEFAULT_TOP):
+    customers = {}
+    for customer_code, dimension, value, count in rows:
+        customer = customers.setdefault(customer_code, {'code': customer_code, 'alerts': 0, 'counts': {}})
+        if dimension == 'alerts':
+            customer['alerts'] = count
+            continue
+        items = customer['counts'].setdefault(dimension, [])
+        if len(items) < top:
+            items.append({'value': value, 'count': count})
+
+    for customer in customers.values():
+        counts = customer.pop('counts')
+        customer['sections'] = [{'title': title, 'items': counts[dimension]} for dimension, title in DIGEST_SECTIONS if dimension in counts]
+    return {'day': day, 'customers': list(customers.values())}
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Summarize the alerts of a day per customer.")
+    parser.add_argument("--day", default=None, help="Day to summarize as YYYY-MM-DD. Defaults to today (UTC).")
+    parser.add_argument("--customer", default=None, help="Only summarize the customer with this code name.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Number of values listed per section.")
+    parser.add_argument("-o", "--output", default=None, help="File to write the digest to. Defaults to the console.")
+    parser.add_argument("--rebuild", action="store_true", help="Recount the digest from all stored alerts first.")
+    args = parser.parse_args(argv)
+
+    day = args.day or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    with AlertStore(databasePath(loadSettings())) as store:
+        if args.rebuild:
+            print(f"Recounted {store.rebuildDigest()} alerts.")
+        rows = store.digest(day, args.customer)
+
+    digest = renderTemplate("digest", digestContext(day, rows, args.top))
+    if args.output:
+        with open(args.output, 'w', encoding="utf8") as f:
+            print(digest, file=f, end='')
+    else:
+        print(digest, end='')
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
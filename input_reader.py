@@ -0,0 +1,110 @@
+# Reading of raw output files of any size and encoding
+#
+# The file is memory mapped, so that its first bytes can be checked without reading the
+# rest, and lines are decoded one at a time while they are read. Text pasted from the
+# Windows clipboard may be saved as UTF-16 or with a byte order mark, and older editors
+# save in the Windows code page, so the encoding is detected from the first bytes and
+# lines that are not valid UTF-8 are decoded as cp1252.
+
+import codecs
+import io
+import mmap
+
+# Number of bytes looked at to detect the encoding and read the first line
+HEADER_SIZE = 4096
+# Number of bytes decoded at a time from UTF-16 files
+CHUNK_SIZE = 64 * 1024
+FALLBACK_ENCODING = "cp1252"
+
+# Returns the encoding of a file and the length of its byte order mark from the first
+# bytes of the file. UTF-16 without a byte order mark is recognized by the zero bytes
+# of ASCII characters.
+def detectEncoding(head):
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8", len(codecs.BOM_UTF8)
+    if head.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le", len(codecs.BOM_UTF16_LE)
+    if head.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be", len(codecs.BOM_UTF16_BE)
+    if len(head) >= 2:
+        if head[1::2].count(0) > len(head) // 4:
+            return "utf-16-le", 0
+        if head[0::2].count(0) > len(head) // 4:
+            return "utf-16-be", 0
+    return "utf-8", 0
+
+def decodeLine(raw):
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode(FALLBACK_ENCODING, errors="replace")
+
+# Maps a file into memory for reading, or returns None for an empty file, which can not
+# be mapped.
+def mapFile(f):
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return None
+
+# Returns the first line of a file, stripped, reading only its first bytes.
+def firstLine(path):
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+    encoding, bom_length = detectEncoding(head)
+    if encoding == "utf-8":
+        return decodeLine(head[bom_length:].split(b"\n", 1)[0]).strip()
+    # Decoding may stop in the middle of a character at the end of the header
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(head[bom_length:])
+    return text.split("\n", 1)[0].strip()
+
+# Yields the stripped lines of a file one at a time without holding the whole file in
+# memory.
+def iterLines(path):
+    with open(path, 'rb') as f:
+        mapped = mapFile(f)
+        if mapped is None:
+            return
+        with mapped:
+            yield from decodeLines(mapped, mapped)
+
+# The lines of a file, which are read anew every time they are gone through, so that the
+# file can be gone through more than once without holding it in memory.
+class FileLines:
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return iterLines(self.path)
+
+# Yields the stripped lines of raw bytes, such as a file in a .zip archive, with the
+# same encoding detection as iterLines.
+def iterBytesLines(data):
+    yield from decodeLines(data, io.BytesIO(data))
+
+# Yields the stripped lines of data that can be sliced, a memory map or bytes, decoded
+# with the detected encoding. UTF-8 lines are read with the readline of reader, which
+# reads the same data.
+def decodeLines(data, reader):
+    encoding, bom_length = detectEncoding(data[:HEADER_SIZE])
+    if encoding == "utf-8":
+        reader.seek(bom_length)
+        readline = reader.readline
+        raw = readline()
+        while raw:
+            yield decodeLine(raw).strip()
+            raw = readline()
+        return
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    rest = ""
+    for offset in range(bom_length, len(data), CHUNK_SIZE):
+        lines = (rest + decoder.decode(data[offset:offset + CHUNK_SIZE])).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line.strip()
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield rest.strip()
@@ -0,0 +1,114 @@
+# Extraction of indicators of compromise (IOCs) from alert values
+#
+# All values of an alert are scanned in a single pass with one combined pattern, where
+# each kind of indicator is a named group. The alternatives are tried in the order they
+# are listed, so that e.g. the domain of a URL or e-mail address is not reported again
+# on its own. Matches that only look like indicators, such as times matching the loose
+# IPv6 pattern, are checked with the ipaddress module before they are kept. Every
+# indicator starts after a character that is not part of a word, which the pattern
+# checks once up front so that positions inside words are skipped without trying each
+# alternative.
+
+import ipaddress
+import re
+
+IOC_RE = re.compile(r"""(?<!\w)(?:
+    (?P<url>\b(?:https?|hxxps?|ftp)(?:://|\[://\]|\[:\]//)[^\s<>"'`]+)
+  | (?P<email>\b[\w.+-]+(?:@|\[@\])(?:[a-z0-9-]+(?:\.|\[\.\]))+[a-z]{2,63}\b)
+  | (?P<sha256>\b[0-9a-f]{64}\b)
+  | (?P<sha1>\b[0-9a-f]{40}\b)
+  | (?P<md5>\b[0-9a-f]{32}\b)
+  | (?P<ipv4>(?<![\w.])(?:\d{1,3}(?:\.|\[\.\])){3}\d{1,3}(?!\w|\.\d))
+  | (?P<ipv6>(?<![\w:.])(?:[0-9a-f]{0,4}:){2,7}[0-9a-f]{0,4}(?![\w:]))
+  | (?P<domain>\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.|\[\.\]))+[a-z]{2,63}\b)
+)""", re.IGNORECASE | re.VERBOSE)
+
+# Kinds of indicators in the order they are listed in reports
+KINDS = ('url', 'domain', 'email', 'ipv4', 'ipv6', 'sha256', 'sha1', 'md5')
+HASH_KINDS = ('sha256', 'sha1', 'md5')
+LABELS = {'url': "URL", 'domain': "Domain", 'email': "E-mail", 'ipv4': "IP", 'ipv6': "IP", 'sha256': "SHA256", 'sha1': "SHA1", 'md5': "MD5"}
+
+# File names in command lines and paths look like domains. Endings that are far more
+# likely to be a file than a top level domain are therefore not reported as domains.
+FILE_EXTENSIONS = frozenset((
+    "exe", "dll", "sys", "drv", "ps1", "psm1", "bat", "cmd", "vbs", "js", "jse", "hta",
+    "msi", "lnk", "scr", "py", "sh", "jar", "txt", "log", "ini", "cfg", "conf", "tmp",
+    "dat", "db", "json", "xml", "csv", "md", "zip", "rar", "7z", "gz", "iso", "img",
+    "doc", "docx", "docm", "xls", "xlsx", "xlsm", "ppt", "pptx", "pdf", "rtf", "one",
+))
+
+# Characters left at the end of a URL by the surrounding text
+URL_TRAILING = ".,;:!?)]}'\""
+
+# Returns the indicator with the defanging brackets and hxxp schemes removed.
+def refang(value):
+    if "[" in value:
+        value = value.replace("[://]", "://").replace("[.]", ".").replace("[@]", "@").replace("[:]", ":")
+    if value[:4].lower() == "hxxp":
+        value = "http" + value[4:]
+    return value
+
+# Returns the indicator in a form that can not be clicked or resolved by accident.
+# Hashes are returned as they are.
+def defang(kind, value):
+    if kind in HASH_KINDS:
+        return value
+    if kind == 'ipv6':
+        return value.replace(":", "[:]")
+    if kind == 'url':
+        scheme, _, rest = value.partition("://")
+        host, slash, path = rest.partition("/")
+        if scheme[:4].lower() == "http":
+            scheme = "hxxp" + scheme[4:]
+        return scheme + "[://]" + host.replace(".", "[.]") + slash + path
+    if kind == 'email':
+        local, _, domain = value.rpartition("@")
+        return local + "[@]" + domain.replace(".", "[.]")
+    return value.replace(".", "[.]")
+
+# Returns the value of a match if it is an indicator of the given kind and None
+# otherwise.
+def checkedValue(kind, value):
+    if kind == 'url':
+        return value.rstrip(URL_TRAILING)
+    if kind == 'ipv4' or kind == 'ipv6':
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return None
+        return None if address.is_unspecified else value
+    if kind == 'domain' and value.rsplit(".", 1)[-1].lower() in FILE_EXTENSIONS:
+        return None
+    return value
+
+# Yields the matches of IOC_RE in an iterable of strings. No indicator contains white
+# space, and all of them contain a '.', ':' or '@' or are hashes of at least 32
+# characters, so the pattern is only run on the words that could hold one. This skips
+# most of the text, such as descriptions, at the speed of str.split. Words repeated in
+# lists of processes and paths are only scanned once.
+def candidateMatches(values):
+    scanned = set()
+    for value in values:
+        for word in value.split():
+            if word in scanned:
+                continue
+            scanned.add(word)
+            if len(word) >= 32 or '.' in word or ':' in word or '@' in word:
+                yield from IOC_RE.finditer(word)
+
+# Returns the distinct indicators found in an iterable of strings as a list of (kind,
+# value) pairs in the order in which they first appear. Values are returned refanged, so
+# that indicators already defanged in the alert are found as well.
+def extractIocs(values):
+    iocs = []
+    seen = set()
+    for match in candidateMatches(values):
+        kind = match.lastgroup
+        value = checkedValue(kind, refang(match.group()))
+        if value is None:
+            continue
+        key = (kind, value.lower())
+        if key not in seen:
+            seen.add(key)
+            iocs.append((kind, value))
+    return iocs
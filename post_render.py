@@ -0,0 +1,82 @@
+# Side effects after the reports are written: opening the editor, copying to the
+# clipboard and starting the update check. Programs are started directly without a
+# shell, and the editor is detached, so the script can exit as soon as the reports are
+# on disk instead of waiting for the editor to be closed.
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+
+# Returns the keyword arguments for subprocess.Popen that start a process detached from
+# the current one, so that it keeps running after the current process exits.
+def detachedProcessOptions():
+    if sys.platform == "win32":
+        return {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+# Splits a command given in the settings into a list of arguments. The command may be a
+# list already, or a string such as the quoted editor path written by setup.py.
+def splitCommand(command):
+    if isinstance(command, list):
+        return command
+    # Windows paths contain backslashes, which POSIX style splitting would remove
+    if os.name == "nt":
+        return [argument.strip("\"") for argument in shlex.split(command, posix=False)]
+    return shlex.split(command)
+
+# Returns the command that opens the reports in the text editor given in the settings.
+def editorCommand(settings_dict, output_paths):
+    return splitCommand(settings_dict['text-program-path']) + list(output_paths)
+
+# Returns the command that reads text from stdin into the clipboard, or None if there is
+# none. Can be set with the clipboard-command setting, where an empty command turns off
+# copying to the clipboard.
+def clipboardCommand(settings_dict):
+    if 'clipboard-command' in settings_dict:
+        command = settings_dict['clipboard-command']
+        return splitCommand(command) if command else None
+    if sys.platform == "win32":
+        return ["clip"]
+    if sys.platform == "darwin":
+        return ["pbcopy"]
+    if shutil.which("xclip"):
+        return ["xclip", "-selection", "clipboard"]
+    return None
+
+def launchDetached(command):
+    return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, **detachedProcessOptions())
+
+# Opens all the reports with a single launch of the text editor given in the settings
+# without waiting for the editor to exit.
+def openReports(settings_dict, output_paths):
+    return launchDetached(editorCommand(settings_dict, output_paths))
+
+def copyToClipboard(settings_dict, text):
+    command = clipboardCommand(settings_dict)
+    if command is None:
+        if 'clipboard-command' in settings_dict:
+            return
+        print("Warning: no clipboard command available. Set clipboard-command in the settings.")
+        return
+    subprocess.run(command, input=text.encode("utf8"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5, check=True)
+
+# Runs the side effects of a run concurrently: opening the reports, copying the text to
+# the clipboard if there is any and, if turned on, starting the update check. A failing
+# side effect is reported without stopping the others.
+def runPostRender(settings_dict, output_paths, clipboard_text=None, update=True):
+    tasks = {'open-editor': (openReports, settings_dict, output_paths)}
+    if clipboard_text:
+        tasks['clipboard'] = (copyToClipboard, settings_dict, clipboard_text)
+    if update and settings_dict['auto-update']:
+        # Only import the update machinery when it is actually going to be used
+        from auto_update import updateInBackground
+        tasks['update'] = (updateInBackground, settings_dict)
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {name: executor.submit(*task) for name, task in tasks.items()}
+    for name, future in futures.items():
+        if future.exception() is not None:
+            print(f"Warning: {name} failed: {future.exception()}")
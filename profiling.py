@@ -0,0 +1,54 @@
+# Timing of the stages of a run
+#
+# The stages are always timed, since reading the clock costs next to nothing. The
+# results are only written when profiling is turned on, as one JSON object per stage and
+# line, so that many runs can be appended to the same log and analyzed later.
+
+from contextlib import contextmanager
+import datetime
+import json
+import os
+import sys
+import time
+
+DEFAULT_PROFILE_LOG_FN = "profile.jsonl"
+
+class StageTimer:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Number of calls and total seconds by stage name, in order of first use
+        self.totals = {}
+
+    def record(self, name, seconds):
+        totals = self.totals.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    # Times the code inside the with-block as the named stage. A stage entered several
+    # times, as in batch mode, is reported with the number of calls and the total time.
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # Returns one dictionary per stage followed by the total wall time since the timer
+    # was created.
+    def results(self):
+        run = datetime.datetime.now().isoformat(timespec="milliseconds") + f"/{os.getpid()}"
+        results = [{'run': run, 'stage': name, 'calls': calls, 'ms': round(seconds*1000, 3)} for name, (calls, seconds) in self.totals.items()]
+        results.append({'run': run, 'stage': "total", 'calls': 1, 'ms': round((time.perf_counter() - self.start)*1000, 3)})
+        return results
+
+    # Appends the results as JSON lines to the file at path, or writes them to stderr if
+    # the path is "-".
+    def emit(self, path):
+        lines = "".join(json.dumps(result) + "\n" for result in self.results())
+        if path == "-":
+            sys.stderr.write(lines)
+        else:
+            with open(path, 'a', encoding="utf8") as f:
+                f.write(lines)
@@ -0,0 +1,94 @@
+# Cache mapping the content of an input file to the report already generated from it, so
+# that running on an unchanged output.txt just reopens the existing report.
+
+from atomic_write import writeFileAtomically
+from report_templates import templateVersion
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+CACHE_FN = ".report_cache.json"
+
+# Returns a version string that changes whenever the templates or the customer code
+# names change, since either changes the report generated from the same input.
+def cacheVersion(code_path):
+    digest = hashlib.sha256(templateVersion().encode("utf8"))
+    with open(code_path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+# Least recently used cache from input hashes to report paths, together with the text
+# copied to the clipboard for the report, stored as a JSON list in the output folder
+# with the most recently used entries last.
+class ReportCache:
+
+    def __init__(self, path, version, max_entries):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.dirty = False
+        try:
+            with open(path, 'r', encoding="utf8") as f:
+                self.entries = OrderedDict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            self.entries = OrderedDict()
+        # Entries written before the clipboard text was cached hold only the path
+        for key in [key for key, entry in self.entries.items() if not isinstance(entry, list)]:
+            del self.entries[key]
+
+    # Hashes the normalized lines of an alert together with the cache version while they
+    # are read. Lines are stripped and trailing empty lines are ignored, so empty lines
+    # are only hashed once a line with text follows them.
+    def key(self, lines):
+        digest = hashlib.sha256(self.version.encode("utf8"))
+        n_empty = 0
+        for line in lines:
+            line = line.strip()
+            if line == "":
+                n_empty += 1
+                continue
+            digest.update(b"\n" * n_empty + line.encode("utf8") + b"\n")
+            n_empty = 0
+        return digest.hexdigest()
+
+    # Returns the path of the report generated for the key and its clipboard text, or None
+    # if there is none or the report has since been deleted.
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        path, clipboard_text = entry
+        if not os.path.exists(path):
+            del self.entries[key]
+            self.dirty = True
+            return None
+        self.entries.move_to_end(key)
+        self.dirty = True
+        return path, clipboard_text
+
+    def put(self, key, path, clipboard_text=None):
+        self.entries[key] = [path, clipboard_text]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    # Writes the cache back to disk if it has changed, through a temporary file so that
+    # an interrupted run cannot leave a broken cache behind. A cache lost in a crash only
+    # means reports are generated again, so it is not synced.
+    def save(self):
+        if not self.dirty:
+            return
+        data = json.dumps(list(self.entries.items())).encode("utf8")
+        writeFileAtomically(self.path, lambda f: f.write(data), fsync=False)
+        self.dirty = False
+
+# Opens the report cache of the output folder given in the settings, or returns None if
+# the cache is turned off.
+def openReportCache(settings_dict):
+    if not settings_dict['report-cache']:
+        return None
+    path = os.path.join(settings_dict['output-folder'], CACHE_FN)
+    return ReportCache(path, cacheVersion(settings_dict['code-names']), settings_dict['report-cache-size'])
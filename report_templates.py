@@ -0,0 +1,226 @@
+# Template engine for the reports
+#
+# Templates are plain text files with the following tags:
+#   {{ name }}, {{ name.field }}      Insert a value from the context
+#   {% if name %} ... {% elif name %} ... {% else %} ... {% endif %}
+#   {% if not name %}                 Conditions test whether the value is truthy
+#   {% for item in name %} ... {% endfor %}
+#                                     Inside a loop, loop.index counts from 1 and
+#                                     loop.last is true for the last item
+#   {% include "name" %}              Insert the template name.tmpl
+# A line holding nothing but a {% %} tag is left out of the output altogether.
+#
+# Each template is compiled once into a Python function that appends the pieces of the
+# report to a single buffer, which is joined at the end.
+
+import os
+import re
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Templates in the user folder take precedence over the ones shipped in the template
+# folder, so that reports can be customized without the changes being overwritten by
+# updates.
+TEMPLATE_FOLDERS = [os.path.join(SCRIPT_FOLDER, "user_templates"), os.path.join(SCRIPT_FOLDER, "templates")]
+TEMPLATE_EXTENSION = ".tmpl"
+
+TOKEN_RE = re.compile(r"(\{\{.*?\}\}|\{%.*?%\})", re.S)
+STANDALONE_TAG_RE = re.compile(r"^[ \t]*(\{%.*?%\})[ \t]*(\n|$)", re.M)
+EXPRESSION_RE = re.compile(r"^(not\s+)?([A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*)$")
+FOR_RE = re.compile(r"^for\s+([A-Za-z_][A-Za-z0-9_]*)\s+in\s+(.+)$")
+INCLUDE_RE = re.compile(r"^include\s+\"([A-Za-z0-9_\-]+)\"$")
+
+# Looks up a field of a value used in a template, which may be a dictionary or an object.
+def field(value, name):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+# Converts a value to the text inserted in the report. Missing values become empty.
+def text(value):
+    if value is None:
+        return ""
+    return str(value)
+
+# Returns the path of a template, looking through the template folders in order.
+def findTemplate(name, folders=TEMPLATE_FOLDERS):
+    for folder in folders:
+        path = os.path.join(folder, name + TEMPLATE_EXTENSION)
+        if os.path.isfile(path):
+            return path
+    raise ValueError("ERROR in findTemplate:\nCould not find template \"" + name + "\" in\n" + "\n".join(folders))
+
+def readTemplate(name, folders=TEMPLATE_FOLDERS):
+    with open(findTemplate(name, folders), 'r', encoding="utf8") as f:
+        return f.read()
+
+# Translates the source of a template to the lines of Python code rendering it
+class TemplateCompiler:
+
+    def __init__(self, name, folders):
+        self.name = name
+        self.folders = folders
+        self.code = ["def render(context):", "    buffer = []", "    write = buffer.append"]
+        self.indent = 1
+        # Stack of the open blocks, and of the open loops as tuples of the loop variable
+        # name and the Python variables holding the item, index and sequence
+        self.blocks = []
+        self.loops = []
+        self.includes = []
+        self.n_variables = 0
+
+    def error(self, message):
+        raise ValueError("ERROR in template \"" + self.name + "\":\n" + message)
+
+    def emit(self, line):
+        self.code.append("    "*self.indent + line)
+
+    # Translates a template expression to a Python expression
+    def expression(self, source):
+        m = EXPRESSION_RE.match(source.strip())
+        if not m:
+            self.error("Invalid expression \"" + source.strip() + "\"")
+        parts = m.group(2).split(".")
+
+        if parts[0] == "loop":
+            if not self.loops or len(parts) != 2 or parts[1] not in ("index", "last"):
+                self.error("loop.index and loop.last can only be used inside a for loop")
+            _, _, index_variable, sequence_variable = self.loops[-1]
+            if parts[1] == "index":
+                python = index_variable
+            else:
+                python = f"({index_variable} == len({sequence_variable}))"
+        else:
+            loop_variables = {loop[0]: loop[1] for loop in self.loops}
+            if parts[0] in loop_variables:
+                python = loop_variables[parts[0]]
+            else:
+                python = f"context.get({parts[0]!r})"
+            for part in parts[1:]:
+                python = f"field({python}, {part!r})"
+
+        if m.group(1):
+            python = "not " + python
+        return python
+
+    def newVariable(self):
+        self.n_variables += 1
+        return f"v{self.n_variables}"
+
+    def statement(self, source):
+        words = source.split(None, 1)
+        keyword = words[0] if words else ""
+        argument = words[1] if len(words) > 1 else ""
+
+        if keyword == "if":
+            self.emit(f"if {self.expression(argument)}:")
+            self.indent += 1
+            self.blocks.append("if")
+        elif keyword in ("elif", "else"):
+            if not self.blocks or self.blocks[-1] != "if":
+                self.error(f"{keyword} without if")
+            self.emit("pass")
+            self.indent -= 1
+            if keyword == "elif":
+                self.emit(f"elif {self.expression(argument)}:")
+            else:
+                self.emit("else:")
+            self.indent += 1
+        elif keyword == "endif":
+            if not self.blocks or self.blocks.pop() != "if":
+                self.error("endif without if")
+            self.emit("pass")
+            self.indent -= 1
+        elif keyword == "for":
+            m = FOR_RE.match(source)
+            if not m:
+                self.error("Invalid for loop \"" + source + "\"")
+            sequence_variable = self.newVariable()
+            index_variable = self.newVariable()
+            item_variable = self.newVariable()
+            self.emit(f"{sequence_variable} = {self.expression(m.group(2))} or ()")
+            self.emit(f"for {index_variable}, {item_variable} in enumerate({sequence_variable}, 1):")
+            self.indent += 1
+            self.blocks.append("for")
+            self.loops.append((m.group(1), item_variable, index_variable, sequence_variable))
+        elif keyword == "endfor":
+            if not self.blocks or self.blocks.pop() != "for":
+                self.error("endfor without for")
+            self.emit("pass")
+            self.indent -= 1
+            self.loops.pop()
+        elif keyword == "include":
+            m = INCLUDE_RE.match(source)
+            if not m:
+                self.error("Invalid include \"" + source + "\"")
+            if m.group(1) in self.includes:
+                self.error("Recursive include of \"" + m.group(1) + "\"")
+            self.includes.append(m.group(1))
+            self.source(readTemplate(m.group(1), self.folders))
+            self.includes.pop()
+        else:
+            self.error("Unknown tag \"{% " + source + " %}\"")
+
+    def source(self, source):
+        source = STANDALONE_TAG_RE.sub(r"\1", source)
+        for token in TOKEN_RE.split(source):
+            if token.startswith("{{"):
+                self.emit(f"write(text({self.expression(token[2:-2])}))")
+            elif token.startswith("{%"):
+                self.statement(token[2:-2].strip())
+            elif token:
+                self.emit(f"write({token!r})")
+
+    def compile(self, source):
+        self.source(source)
+        if self.blocks:
+            self.error("Missing end" + self.blocks[-1])
+        self.code.append("    return \"\".join(buffer)")
+        namespace = {'field': field, 'text': text}
+        exec(compile("\n".join(self.code), "<template " + self.name + ">", "exec"), namespace)
+        return namespace['render']
+
+# Compiles the source of a template into a function taking a context dictionary and
+# returning the rendered text.
+def compileTemplate(source, name="<string>", folders=TEMPLATE_FOLDERS):
+    return TemplateCompiler(name, folders).compile(source)
+
+# Compiled templates by name, stored together with the version of the templates they
+# were compiled for, so that each template is only compiled once per version.
+compiled_templates = {}
+# Version of the templates in each list of folders as last returned by templateVersion.
+# Templates compiled for another version are compiled again, so that reports rendered
+# after templateVersion has been called use the templates of the version it returned,
+# e.g. the version a report is cached under.
+template_versions = {}
+
+def loadTemplate(name, folders=TEMPLATE_FOLDERS):
+    key = (name, tuple(folders))
+    version = template_versions.get(key[1])
+    cached = compiled_templates.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, compileTemplate(readTemplate(name, folders), name, folders))
+        compiled_templates[key] = cached
+    return cached[1]
+
+def renderTemplate(name, context, folders=TEMPLATE_FOLDERS):
+    return loadTemplate(name, folders)(context)
+
+# Returns a hash of the contents of all templates that can be used, which changes whenever
+# any template is edited, added or overridden. Templates compiled for an earlier version
+# are compiled again when they are next used.
+def templateVersion(folders=TEMPLATE_FOLDERS):
+    import hashlib
+    digest = hashlib.sha256()
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for fn in sorted(os.listdir(folder)):
+            if fn.endswith(TEMPLATE_EXTENSION):
+                digest.update(os.path.join(folder, fn).encode("utf8") + b"\0")
+                with open(os.path.join(folder, fn), 'rb') as f:
+                    digest.update(f.read() + b"\0")
+    template_versions[tuple(folders)] = digest.hexdigest()
+    return template_versions[tuple(folders)]
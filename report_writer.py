@@ -0,0 +1,128 @@
+# Writes reports to the output folder without asking what to do with existing files.
+#
+# The folder is listed once when the writer is opened, and collisions with existing
+# reports are resolved against that set of names according to the collision policy:
+#
+#   overwrite  replace the existing report
+#   suffix     keep the existing report and write the new one as <name>_2.md, <name>_3.md, ...
+#   skip       keep the existing report and do not write the new one
+#   version    move the existing report to <name>_v1.md, <name>_v2.md, ... and write the
+#              new one under the original name
+#
+# Each report is first written to a hidden temporary file in the same folder. The
+# temporary files are synced to disk and renamed to their final names in batches, so
+# that a crash never leaves a half written report behind while thousands of reports
+# only cost one sync of the folder per batch.
+
+import os
+
+COLLISION_POLICIES = ("overwrite", "suffix", "skip", "version")
+DEFAULT_BATCH_SIZE = 256
+
+class ReportWriter:
+
+    def __init__(self, folder, policy, fsync=True, batch_size=DEFAULT_BATCH_SIZE):
+        if policy not in COLLISION_POLICIES:
+            raise ValueError("ERROR in ReportWriter:\nUnknown collision policy '" + str(policy) + "'. Use one of " + ", ".join(COLLISION_POLICIES))
+        self.folder = folder
+        self.policy = policy
+        self.fsync = fsync
+        self.batch_size = batch_size
+        os.makedirs(folder, exist_ok=True)
+        with os.scandir(folder) as entries:
+            self.names = {entry.name for entry in entries}
+        # (temporary name, final name) of the reports written since the last flush
+        self.pending = []
+        self.n_written = 0
+        # Reports not written since the skip policy kept the existing ones
+        self.n_skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def path(self, name):
+        return os.path.normpath(os.path.join(self.folder, name))
+
+    # Returns the first of <stem><separator><n><extension> for n = start, start + 1, ...
+    # that is not taken in the folder.
+    def freeName(self, name, separator, start):
+        stem, extension = os.path.splitext(name)
+        n = start
+        while f"{stem}{separator}{n}{extension}" in self.names:
+            n += 1
+        return f"{stem}{separator}{n}{extension}"
+
+    # Moves the report with the given name out of the way for the version policy. A
+    # report still waiting in the current batch is simply given the new name.
+    def moveAside(self, name):
+        versioned_name = self.freeName(name, "_v", 1)
+        self.names.add(versioned_name)
+        for i, (tmp_name, final_name) in enumerate(self.pending):
+            if final_name == name:
+                self.pending[i] = (tmp_name, versioned_name)
+                return
+        os.replace(self.path(name), self.path(versioned_name))
+
+    # Writes a report under the given file name, or the name the collision policy gives
+    # it, and returns its path. With the skip policy the path of the existing report is
+    # returned instead. The report is in place once the writer is flushed.
+    def write(self, name, text):
+        if name in self.names:
+            if self.policy == "skip":
+                self.n_skipped += 1
+                return self.path(name)
+            if self.policy == "suffix":
+                name = self.freeName(name, "_", 2)
+            elif self.policy == "version":
+                self.moveAside(name)
+
+        # Unique even if the same name is written twice in a batch with the overwrite policy
+        tmp_name = f".{name}.{os.getpid()}.{self.n_written}.tmp"
+        # Opened with os.open so that the file gets the usual permissions for new files
+        fd = os.open(self.path(tmp_name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        with open(fd, 'w', encoding="utf8") as f:
+            print(text, file=f, end='')
+        self.names.add(name)
+        self.pending.append((tmp_name, name))
+        self.n_written += 1
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return self.path(name)
+
+    # Syncs the reports of the current batch to disk and renames them to their final
+    # names, followed by a single sync of the folder.
+    def flush(self):
+        if not self.pending:
+            return
+        if self.fsync:
+            for tmp_name, _ in self.pending:
+                fd = os.open(self.path(tmp_name), os.O_RDWR)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        for tmp_name, final_name in self.pending:
+            os.replace(self.path(tmp_name), self.path(final_name))
+        self.pending = []
+        # The renames themselves are only durable once the folder is synced. Folders can
+        # not be opened for syncing on Windows.
+        if self.fsync and os.name != "nt":
+            fd = os.open(self.folder, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        self.flush()
+
+# Opens a report writer for the output folder given in the settings. The collision
+# policy is given by report-collision and syncing can be turned off with report-fsync.
+def openReportWriter(settings_dict, folder=None):
+    if folder is None:
+        folder = settings_dict['output-folder']
+    return ReportWriter(folder, settings_dict['report-collision'], settings_dict['report-fsync'])
@@ -1,39 +1,179 @@
 # Main-file reserved for future feature creep and command line options
 # v. 0.0.1
 
-from file_functions import loadSettings, readInputFile, formatAlertDict, generateReportString
-from file_functions import generateFileName, writeStringToFile
+# Taken before anything else is imported, so that the time spent importing can be profiled
+import time
+IMPORT_START = time.perf_counter()
 
-from auto_update import update
+from file_functions import loadSettings, readInputFile, splitAlerts, formatAlertRecord, generateReportString
+from file_functions import generateFileName, generateCustomerCode
+from ioc_extractor import extractIocs
+from alert_store import AlertStore, databasePath
+from report_cache import openReportCache
+from report_writer import openReportWriter
+from profiling import StageTimer, DEFAULT_PROFILE_LOG_FN
+from post_render import runPostRender
 
+import argparse
 import os
 import sys
 
-def main(argv):
-    
-    settings_dict = loadSettings()
+# Generates the report for a single alert given as lines, writes it to the output folder
+# with the ReportWriter and returns the AlertRecord of the alert together with the report
+# path and the text to copy to the clipboard, which is the incident url or None. The
+# report is in place once the writer has been flushed. If the report cache already holds
+# a report for the same lines, the path and clipboard text of that report are returned
+# instead with None in place of the record. Given an AlertStore, the indicators seen in
+# earlier alerts are marked in the report and the alert is stored.
+def renderAlert(lines, settings_dict, writer, cache=None, timer=None, store=None):
+    if timer is None:
+        timer = StageTimer()
+
+    if cache is not None:
+        with timer.stage("cache-lookup"):
+            key = cache.key(lines)
+            cached = cache.get(key)
+        if cached is not None:
+            cached_path, clipboard_text = cached
+            print("Report already generated: " + cached_path)
+            return None, cached_path, clipboard_text
+
+    with timer.stage("parse"):
+        record = formatAlertRecord(lines)
+
+    with timer.stage("extract-iocs"):
+        iocs = extractIocs(record.values())
+    sightings = None
+    if store is not None:
+        with timer.stage("ioc-lookup"):
+            sightings = store.sightings(iocs, record['case-number'])
+
+    with timer.stage("render"):
+        report = generateReportString(record, iocs, sightings)
+
+    # Looked up before the report is written, so that an unknown customer leaves nothing
+    # half done
+    with timer.stage("file-name"):
+        output_fn = generateFileName(record, settings_dict)
+        customer_code = generateCustomerCode(record['customer-name'], settings_dict) if store is not None else None
+
+    clipboard_text = record['incident url'] if 'incident url' in record else None
+    with timer.stage("write"):
+        output_path = writer.write(output_fn, report)
+    if cache is not None:
+        cache.put(key, output_path, clipboard_text)
+    # Stored right away, so that later alerts of a batch see the indicators of this one
+    if store is not None:
+        with timer.stage("store"):
+            store.insertAlert(record, customer_code, iocs)
+
+    return record, output_path, clipboard_text
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description="Generate alert reports from raw output.")
+    parser.add_argument("-b", "--batch", action="store_true", help="Generate one report for each of the alerts concatenated in the output file.")
+    parser.add_argument("--profile", action="store_true", help="Write the time spent in each stage as JSON lines. Can also be turned on with the 'profile' setting.")
+    parser.add_argument("--profile-log", default=None, help="File to append the stage times to, or - for stderr. Defaults to the 'profile-log' setting or profile.jsonl in the output folder.")
+    parser.add_argument("--cprofile", default=None, metavar="PATH", help="Run under cProfile and dump the statistics to PATH.")
+    parser.add_argument("--settings", default="settings.conf", metavar="PATH", help="Settings file to use. Defaults to settings.conf next to the scripts or in the current folder.")
+    return parser.parse_args(argv)
+
+# Generates reports for the alerts in the output file given in the settings and returns
+# the paths of the generated reports together with the text to copy to the clipboard,
+# which is the incident url of a single alert or None. In batch mode every alert in the
+# file gets its own report, and alerts that can not be read or rendered are reported and
+# skipped. The stages are timed with the given StageTimer.
+def generateReports(settings_dict, batch=False, timer=None):
+    if timer is None:
+        timer = StageTimer()
     input_path = os.path.normpath(settings_dict['output-folder'] + "/" + settings_dict['output-filename'])
-    
-    input = readInputFile(input_path)
-    alert_dict = formatAlertDict(input)
-
-    if 'incident url' in alert_dict:
-        print("Debug hello world")
-        os.system("echo " + alert_dict['incident url'] + " | clip")
-    
-    report = generateReportString(alert_dict)
-    
-    output_fn = generateFileName(alert_dict, settings_dict['code-names'])
-    output_path = os.path.normpath(settings_dict['output-folder'] + "/" + output_fn)
-    
-    writeStringToFile(output_path, report)
-    
-    cmd = settings_dict['text-program-path'] + " \"" + output_path + "\""
-    os.system(cmd)
-    
-    if settings_dict['auto-update']:
-       update(settings_dict)
-        
+
+    with timer.stage("open-cache"):
+        cache = openReportCache(settings_dict)
+    # The parsed alerts are kept for later lookups, all in one transaction
+    store = None
+    if settings_dict['store-alerts']:
+        with timer.stage("open-store"):
+            store = AlertStore(databasePath(settings_dict))
+
+    with timer.stage("open-writer"):
+        writer = openReportWriter(settings_dict)
+
+    clipboard_text = None
+    try:
+        if batch:
+            output_paths = []
+            n_generated = 0
+            n_failed = 0
+            for lines in splitAlerts(input_path):
+                try:
+                    record, output_path, _ = renderAlert(lines, settings_dict, writer, cache, timer, store)
+                except (ValueError, KeyError, AttributeError, IndexError) as e:
+                    print(f"Warning: skipped alert {lines[0] if lines else ''}: {e}", file=sys.stderr)
+                    n_failed += 1
+                    continue
+                if record is not None:
+                    n_generated += 1
+                output_paths.append(output_path)
+            # Reports kept by the skip collision policy were rendered but not written
+            n_kept = writer.n_skipped
+            print(f"Generated {n_generated - n_kept} reports, reused {len(output_paths) - n_generated}" + (f", kept {n_kept} existing" if n_kept else "") + (f", skipped {n_failed}." if n_failed else "."))
+        else:
+            with timer.stage("read-input"):
+                input = readInputFile(input_path)
+            record, output_path, clipboard_text = renderAlert(input, settings_dict, writer, cache, timer, store)
+            output_paths = [output_path]
+
+    finally:
+        # The reports written so far are put in place before their alerts are stored and
+        # cached, also when an alert failed, so that running again does not write them a
+        # second time. Nothing is stored or cached if they could not be put in place.
+        try:
+            with timer.stage("flush-reports"):
+                writer.close()
+            if store is not None:
+                with timer.stage("commit-store"):
+                    store.commit()
+            if cache is not None:
+                with timer.stage("save-cache"):
+                    cache.save()
+        finally:
+            if store is not None:
+                store.close()
+
+    return output_paths, clipboard_text
+
+def main(argv):
+
+    timer = StageTimer()
+    timer.record("imports", timer.start - IMPORT_START)
+
+    args = parseArguments(argv)
+
+    with timer.stage("load-settings"):
+        settings_dict = loadSettings(args.settings)
+
+    cprofile_path = args.cprofile or settings_dict.get('cprofile-path')
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    output_paths, clipboard_text = generateReports(settings_dict, args.batch, timer)
+
+    # The editor and the update check are started in the background, so that this
+    # process can exit as soon as the reports are written.
+    with timer.stage("post-render"):
+        runPostRender(settings_dict, output_paths, clipboard_text)
+
+    if cprofile_path:
+        profiler.disable()
+        profiler.dump_stats(cprofile_path)
+
+    if args.profile or settings_dict['profile']:
+        profile_log = args.profile_log or settings_dict.get('profile-log', os.path.join(settings_dict['output-folder'], DEFAULT_PROFILE_LOG_FN))
+        timer.emit(profile_log)
+
     return
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+# Resident daemon that keeps settings and parsers loaded and generates a report each
+# time the output file is saved or a trigger arrives from sentinel_trigger.py.
+
+from file_functions import loadSettings
+from sentinel_alerts import generateReports
+from post_render import runPostRender
+from report_templates import templateVersion
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Watches the folder of a file with inotify and reports when the file has been written
+# to or replaced. Only available on Linux.
+class InotifyWatcher:
+
+    def __init__(self, path):
+        self.file_name = os.path.basename(path)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("ERROR in InotifyWatcher:\ninotify is not available on this platform.")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "ERROR in InotifyWatcher:\nCould not initialize inotify.")
+        folder = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "ERROR in InotifyWatcher:\nCould not watch folder " + folder)
+
+    def fileno(self):
+        return self.fd
+
+    # Reads all pending events and returns True if any of them concern the watched file.
+    def changed(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if os.fsdecode(name) == self.file_name:
+                    changed = True
+
+    def close(self):
+        os.close(self.fd)
+
+# Watches a file by comparing its modification time and size each time changed() is
+# called. Used where inotify is not available.
+class PollingWatcher:
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = self.statSignature()
+
+    def statSignature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def fileno(self):
+        return None
+
+    def changed(self):
+        signature = self.statSignature()
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def close(self):
+        pass
+
+# Returns an inotify watcher for the path if possible and a polling watcher otherwise.
+def createWatcher(path, force_poll=False):
+    if not force_poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            print(f"Warning: {e}. Falling back to polling.")
+    return PollingWatcher(path)
+
+# Generates and opens the reports while making sure that a bad input file does not
+# bring down the daemon. Returns the report paths, or an empty list on failure.
+def safeGenerateReports(settings_dict, batch):
+    start = time.perf_counter()
+    try:
+        # Picks up settings and code names edited while the daemon runs, which only
+        # costs a check of their modification times
+        settings_dict = loadSettings(settings_dict.path)
+        # Picks up templates edited while the daemon runs, also when the report cache,
+        # which does the same, is turned off
+        templateVersion()
+        output_paths, clipboard_text = generateReports(settings_dict, batch)
+    except Exception as e:
+        print(f"Could not generate report: {e}")
+        return []
+    print(f"Generated report in {(time.perf_counter() - start)*1000:.1f} ms")
+    # The daemon checks for updates when it is restarted, not after every report
+    runPostRender(settings_dict, output_paths, clipboard_text, update=False)
+    return output_paths
+
+# Reads a single command line from a trigger client, generates the reports and sends
+# back the paths of the reports, one per line.
+def handleTrigger(connection, settings_dict):
+    with connection:
+        connection.settimeout(2)
+        try:
+            command = connection.makefile("r", encoding="utf8").readline().strip()
+        except OSError:
+            return
+        if command not in ("render", "batch"):
+            connection.sendall(f"error: unknown command '{command}'\n".encode("utf8"))
+            return
+        output_paths = safeGenerateReports(settings_dict, command == "batch")
+        if output_paths:
+            connection.sendall("".join(path + "\n" for path in output_paths).encode("utf8"))
+        else:
+            connection.sendall(b"error: could not generate report\n")
+
+def runDaemon(settings_dict, force_poll=False):
+    input_path = os.path.normpath(settings_dict['output-folder'] + "/" + settings_dict['output-filename'])
+    port = settings_dict['daemon-port']
+    poll_interval = settings_dict['daemon-poll-interval']
+    render_on_save = settings_dict['daemon-render-on-save']
+
+    server = socket.create_server(("127.0.0.1", port))
+    watcher = createWatcher(input_path, force_poll)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ, "trigger")
+    if watcher.fileno() is not None:
+        selector.register(watcher, selectors.EVENT_READ, "watch")
+        timeout = None
+    else:
+        timeout = poll_interval
+
+    print(f"Watching {input_path} ({type(watcher).__name__}) and listening on port {port}.")
+    try:
+        while True:
+            for key, _ in selector.select(timeout):
+                if key.data == "trigger":
+                    connection, _ = server.accept()
+                    handleTrigger(connection, settings_dict)
+            if watcher.changed() and render_on_save:
+                safeGenerateReports(settings_dict, False)
+    except KeyboardInterrupt:
+        print("Stopping daemon.")
+    finally:
+        selector.close()
+        watcher.close()
+        server.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Keep sentinel_alerts loaded and generate reports on save or trigger.")
+    parser.add_argument("--poll", action="store_true", help="Watch the output file by polling even if inotify is available.")
+    args = parser.parse_args(argv)
+
+    runDaemon(loadSettings(), args.poll)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
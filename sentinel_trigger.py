@@ -0,0 +1,38 @@
+# Thin client for the hotkey. Asks a running sentinel_daemon.py to generate the report
+# and falls back to a full run of sentinel_alerts.py if no daemon is listening.
+
+# Only the settings are loaded, the report machinery is not imported unless no daemon
+# is listening
+from config import loadConfig
+
+import socket
+import sys
+
+# Sends a command to the daemon and returns the lines of its reply.
+def sendCommand(command, port, timeout=30):
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as connection:
+        connection.sendall((command + "\n").encode("utf8"))
+        reply = b""
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            reply += data
+    return reply.decode("utf8").splitlines()
+
+def main(argv):
+    settings_dict = loadConfig()
+    command = "batch" if ("-b" in argv or "--batch" in argv) else "render"
+
+    try:
+        reply = sendCommand(command, settings_dict['daemon-port'])
+    except (ConnectionRefusedError, socket.timeout):
+        import sentinel_alerts
+        sentinel_alerts.main(argv)
+        return
+
+    for line in reply:
+        print(line)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
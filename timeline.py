@@ -0,0 +1,153 @@
+# Builds one chronological timeline from the alerts in many raw output files, e.g. for an
+# incident spanning several cases.
+#
+# Every alert has up to four times (@timestamp, Event time, Log time and Info search
+# time, given as ISO times or epoch seconds), which can be far apart, e.g. an alert
+# raised months after the logged event. Each time is therefore read as its own lazy
+# stream of events from every file, and the times are converted to epoch seconds a chunk
+# of alerts at a time, with the events of each chunk sorted. The streams are then merged
+# with a heap, so only one chunk per file and time is in memory at a time. The merge
+# assumes that each file lists its alerts in chronological order, which makes every
+# stream sorted, and a warning is printed for files that do not.
+
+from file_functions import splitAlerts, formatAlertRecord
+
+from datetime import datetime, timezone
+import argparse
+import heapq
+import re
+import sys
+
+# Alert keys holding times and the names they are shown with in the timeline
+TIME_KEYS = (
+    ('timestamp', "@timestamp"),
+    ('event time', "Event time"),
+    ('log time', "Log time"),
+    ('info search time', "Info search time"),
+)
+# Alert keys describing the alert, in order of preference
+SUMMARY_KEYS = ('info description', 'incident title', 'description', 'title', 'info sub name')
+DEFAULT_CHUNK_SIZE = 64
+
+EPOCH_RE = re.compile(r"^[0-9]+(?:\.[0-9]+)?$")
+# ISO times as in the raw output, 2023-10-08T16:21:01.010Z, and as stored by parseAlert,
+# 2023-10-08 16:21:01.010 UTC
+ISO_RE = re.compile(r"^([0-9]{4})-([0-9]{2})-([0-9]{2})[T ]([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.([0-9]+))?\s*(?:Z|UTC)?$")
+
+# Epoch times above this are taken to be in milliseconds
+MAX_EPOCH_SECONDS = 1e11
+
+# Converts a list of time strings to epoch seconds in one go. Epoch times are converted
+# together with float, and ISO times are read with a single compiled pattern. Times that
+# can not be read become None.
+def normalizeTimes(values):
+    is_epoch = [EPOCH_RE.match(value) is not None for value in values]
+    epochs = iter(map(float, [value for value, epoch in zip(values, is_epoch) if epoch]))
+
+    times = []
+    for value, epoch in zip(values, is_epoch):
+        if epoch:
+            seconds = next(epochs)
+            times.append(seconds / 1000 if seconds > MAX_EPOCH_SECONDS else seconds)
+            continue
+        m = ISO_RE.match(value)
+        if m is None:
+            times.append(None)
+            continue
+        year, month, day, hour, minute, second, fraction = m.groups()
+        seconds = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=timezone.utc).timestamp()
+        times.append(seconds + (float("0." + fraction) if fraction else 0.0))
+    return times
+
+def formatTime(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + " UTC"
+
+def alertSummary(alert_dict):
+    for key in SUMMARY_KEYS:
+        value = alert_dict.get(key, "")
+        if value != "" and value != "``":
+            return value
+    return ""
+
+# Turns a chunk of parsed alerts into a sorted list of the events (epoch seconds, case
+# number, time name, summary) of one of the TIME_KEYS. Returns the events and the number
+# of unreadable times.
+def chunkEvents(alert_dicts, key, name):
+    with_time = []
+    values = []
+    for alert_dict in alert_dicts:
+        value = alert_dict.get(key, "").strip()
+        if value != "" and value != "-":
+            with_time.append(alert_dict)
+            values.append(value)
+
+    events = []
+    n_unreadable = 0
+    for alert_dict, seconds in zip(with_time, normalizeTimes(values)):
+        if seconds is None:
+            n_unreadable += 1
+            continue
+        events.append((seconds, alert_dict['case-number'], name, alertSummary(alert_dict)))
+    events.sort()
+    return events, n_unreadable
+
+# Reads the alerts of a file lazily and yields the events of one of the TIME_KEYS a
+# sorted chunk at a time. Warns if a chunk starts before the end of the previous one,
+# which breaks the chronological order the merge relies on, and stops at files or alerts
+# that can not be read. As every time of a file is read by its own stream, only the
+# stream of the first time reports read errors.
+def eventStream(path, key, name, chunk_size=DEFAULT_CHUNK_SIZE, report_errors=True):
+    last_time = None
+    chunk = []
+    alerts = splitAlerts(path)
+    while True:
+        try:
+            for lines in alerts:
+                chunk.append(formatAlertRecord(lines))
+                if len(chunk) == chunk_size:
+                    break
+        except (OSError, ValueError, AttributeError, IndexError) as e:
+            if report_errors:
+                print(f"Warning: stopped reading {path}: {e}", file=sys.stderr)
+            alerts = iter(())
+        if not chunk:
+            return
+
+        events, n_unreadable = chunkEvents(chunk, key, name)
+        chunk = []
+        if n_unreadable:
+            print(f"Warning: skipped {n_unreadable} unreadable {name} times in {path}", file=sys.stderr)
+        if events and last_time is not None and events[0][0] < last_time:
+            print(f"Warning: the {name} times in {path} are not in chronological order around {events[0][1]}; the timeline may be out of order.", file=sys.stderr)
+        if events:
+            last_time = events[-1][0]
+        yield from events
+
+# Yields the events of all files merged into one chronological timeline. The events are
+# merged as whole tuples, so the same alert pasted into several files gives identical
+# events next to each other, of which only the first is kept.
+def buildTimeline(paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    previous = None
+    streams = [eventStream(path, key, name, chunk_size, report_errors=(i == 0)) for path in paths for i, (key, name) in enumerate(TIME_KEYS)]
+    for event in heapq.merge(*streams):
+        if event != previous:
+            yield event
+        previous = event
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Merge the alerts in raw output files into one chronological timeline.")
+    parser.add_argument("files", nargs="+", help="Raw output files, each holding one or more alerts in chronological order.")
+    parser.add_argument("-o", "--output", default=None, help="File to write the timeline to. Defaults to the console.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of alerts per file read and sorted at a time.")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w', encoding="utf8") if args.output else sys.stdout
+    try:
+        for seconds, case_number, name, summary in buildTimeline(args.files, args.chunk_size):
+            print(f"{formatTime(seconds)}  {case_number}  {name:<16}  {summary}", file=out)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+   main(sys.argv[1:])